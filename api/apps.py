@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Web workers (see wsgi.py / asgi.py) start indexing reviews for the
+        # ask endpoint before the first question instead of during it
+        if settings.SENTIMENT_WARMUP:
+            from .retrieval import get_review_index
+            get_review_index()
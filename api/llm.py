@@ -0,0 +1,284 @@
+"""
+Gemini client and answer cache for the ask endpoint.
+
+All calls share one ``requests.Session`` per process, so connections are kept
+alive and reused, and every call has connect/read timeouts and a bounded
+number of retries. The async endpoint uses one ``httpx.AsyncClient`` per event
+loop instead, with a semaphore capping calls in flight to Gemini. Both can
+stream an answer as server-sent events from ``streamGenerateContent``, and
+both HTTP libraries are imported on first use, so loading the URLconf
+doesn't pay for them.
+
+Answers are cached in the ``answers`` cache, keyed by the normalized
+question and version stamps of the prediction data and of the review index,
+so a new prediction, or the index catching up after a restart, invalidates
+earlier answers.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+
+from scraper.models import Prediction
+
+
+class LLMError(Exception):
+    """The LLM could not be reached or returned an unusable response"""
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide pooled HTTP session"""
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=settings.GEMINI_MAX_RETRIES,
+                    backoff_factor=0.5,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset({'POST'}),
+                    # Hand the last response back instead of raising
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_maxsize=settings.GEMINI_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def build_prompt(question, context):
+    return f"""
+        You are an assistant analyzing movie reviews.
+
+        Context:
+        Here are the cleaned reviews most relevant to the question, with predicted sentiments:
+        {context}
+
+        Question:
+        {question}
+        """
+
+
+def gemini_url(method='generateContent'):
+    return f"{settings.GEMINI_API_BASE}/models/{settings.GEMINI_MODEL}:{method}"
+
+
+def gemini_headers():
+    # Sent as a header so the key never shows up in URLs or error messages
+    return {'x-goog-api-key': settings.GEMINI_API_KEY or ''}
+
+
+def gemini_payload(prompt):
+    return {
+        "contents": [
+            {"parts": [{"text": prompt}]}
+        ]
+    }
+
+
+def answer_text(data):
+    try:
+        return data['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        raise LLMError('Unexpected Gemini response')
+
+
+def generate(prompt):
+    """Return Gemini's answer to ``prompt``, raising LLMError on failure"""
+    import requests
+
+    try:
+        res = get_session().post(
+            gemini_url(),
+            headers=gemini_headers(),
+            json=gemini_payload(prompt),
+            timeout=(settings.GEMINI_CONNECT_TIMEOUT, settings.GEMINI_READ_TIMEOUT),
+        )
+    except requests.RequestException as e:
+        raise LLMError(f'Gemini request failed: {e}')
+
+    if res.status_code != 200:
+        raise LLMError(f'Gemini API returned {res.status_code}')
+    try:
+        return answer_text(res.json())
+    except ValueError:
+        raise LLMError('Unexpected Gemini response')
+
+
+def chunk_text(data):
+    """Text of one streamed chunk; the last chunk may carry none"""
+    candidates = data.get('candidates') or [{}]
+    parts = candidates[0].get('content', {}).get('parts', [])
+    return ''.join(part.get('text', '') for part in parts)
+
+
+def sse_data(line):
+    """Decoded JSON of an SSE ``data:`` line, or None for any other line"""
+    if not line or not line.startswith('data:'):
+        return None
+    try:
+        return json.loads(line[5:])
+    except ValueError:
+        raise LLMError('Unexpected Gemini response')
+
+
+def stream_generate(prompt):
+    """Yield pieces of Gemini's answer to ``prompt`` as they arrive"""
+    import requests
+
+    try:
+        res = get_session().post(
+            gemini_url('streamGenerateContent'),
+            params={'alt': 'sse'},
+            headers=gemini_headers(),
+            json=gemini_payload(prompt),
+            timeout=(settings.GEMINI_CONNECT_TIMEOUT, settings.GEMINI_READ_TIMEOUT),
+            stream=True,
+        )
+    except requests.RequestException as e:
+        raise LLMError(f'Gemini request failed: {e}')
+
+    with res:
+        if res.status_code != 200:
+            raise LLMError(f'Gemini API returned {res.status_code}')
+        # SSE is always UTF-8, but without a charset requests assumes ISO-8859-1
+        res.encoding = 'utf-8'
+        try:
+            # chunk_size=None hands over data as soon as it arrives
+            for line in res.iter_lines(chunk_size=None, decode_unicode=True):
+                data = sse_data(line)
+                if data is not None:
+                    text = chunk_text(data)
+                    if text:
+                        yield text
+        except requests.RequestException as e:
+            raise LLMError(f'Gemini stream failed: {e}')
+
+
+class AsyncGeminiClient:
+    """Pooled async HTTP client bound to one event loop"""
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self):
+        import httpx
+
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.GEMINI_READ_TIMEOUT, connect=settings.GEMINI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=settings.GEMINI_MAX_IN_FLIGHT),
+        )
+        # Requests beyond the cap wait here instead of piling onto Gemini
+        self.in_flight = asyncio.Semaphore(settings.GEMINI_MAX_IN_FLIGHT)
+
+    async def post(self, url, payload):
+        """POST with the same retry policy as the sync session"""
+        import httpx
+
+        for attempt in range(settings.GEMINI_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                res = await self.http.post(url, headers=gemini_headers(), json=payload)
+            except httpx.HTTPError as e:
+                if attempt == settings.GEMINI_MAX_RETRIES:
+                    raise LLMError(f'Gemini request failed: {e}')
+                continue
+            if res.status_code not in self.RETRY_STATUSES:
+                break
+        return res
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def close_with_loop(client):
+    """Parked on its yield until the loop shuts down, then closes ``client``"""
+    try:
+        yield
+    finally:
+        await client.http.aclose()
+
+
+async def get_async_client():
+    """Return the Gemini client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncGeminiClient()
+        # Loops end with shutdown_asyncgens() (asyncio.run, which async_to_sync
+        # uses for each async view under WSGI, and ASGI servers), which closes
+        # this generator and so the client and its connection pool
+        client.closer = close_with_loop(client)
+        await client.closer.asend(None)
+    return client
+
+
+async def agenerate(prompt):
+    """Async version of generate()"""
+    client = await get_async_client()
+    async with client.in_flight:
+        res = await client.post(gemini_url(), gemini_payload(prompt))
+    if res.status_code != 200:
+        raise LLMError(f'Gemini API returned {res.status_code}')
+    try:
+        return answer_text(res.json())
+    except ValueError:
+        raise LLMError('Unexpected Gemini response')
+
+
+async def astream_generate(prompt):
+    """Async version of stream_generate(); not retried once streaming starts"""
+    import httpx
+
+    client = await get_async_client()
+    async with client.in_flight:
+        try:
+            async with client.http.stream(
+                    'POST', gemini_url('streamGenerateContent'), params={'alt': 'sse'},
+                    headers=gemini_headers(), json=gemini_payload(prompt)) as res:
+                if res.status_code != 200:
+                    raise LLMError(f'Gemini API returned {res.status_code}')
+                async for line in res.aiter_lines():
+                    data = sse_data(line)
+                    if data is not None:
+                        text = chunk_text(data)
+                        if text:
+                            yield text
+        except httpx.HTTPError as e:
+            raise LLMError(f'Gemini stream failed: {e}')
+
+
+def data_version():
+    # Prediction ids only grow, so the newest id changes whenever data is added
+    return Prediction.objects.aggregate(version=Max('id'))['version'] or 0
+
+
+async def adata_version():
+    return (await Prediction.objects.aaggregate(version=Max('id')))['version'] or 0
+
+
+def answer_cache_key(question, *versions):
+    normalized = ' '.join(question.lower().split())
+    stamp = ':'.join(str(version) for version in versions)
+    digest = hashlib.sha256(f'{stamp}:{normalized}'.encode()).hexdigest()
+    return f'ask:{digest}'
+
+
+def get_answer_cache():
+    return caches['answers']
@@ -0,0 +1,37 @@
+"""
+Keyset (cursor) pagination over ``(created_at, id)``.
+
+Cursors are opaque, URL-safe strings that encode the position of the last row
+on a page, so each page is one indexed range scan however deep the client
+pages, and rows inserted meanwhile never shift the page boundaries.
+"""
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(created_at, pk):
+    raw = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)`` for a cursor, raising ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    if created_at is None:
+        raise ValueError('Invalid cursor')
+    return created_at, pk
+
+
+def after_cursor(queryset, cursor):
+    """Rows strictly after the cursor position in ``(created_at, id)`` order"""
+    created_at, pk = decode_cursor(cursor)
+    return queryset.filter(
+        Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
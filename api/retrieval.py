@@ -0,0 +1,308 @@
+"""
+Relevance-ranked review context for the ask endpoint.
+
+``ReviewIndex`` is an in-process BM25 index over ``CleanedData.cleaned_text``.
+A background thread keeps it up to date, so asks never wait on indexing.
+Each refresh reads rows above the highest indexed id and re-checks the
+ASK_INDEX_LOOKBACK ids below it, since rows can commit out of id order; every
+ASK_INDEX_RECONCILE_SECONDS it re-checks every id. Each refresh adds an
+immutable segment whose postings are ordered by impact; searches read the
+current tuple of segments without a lock and walk at most
+ASK_INDEX_MAX_POSTINGS postings per term, skipping terms found in more than
+ASK_INDEX_MAX_DF of the reviews, so query cost is bounded however large the
+table grows. ``build_context`` picks the reviews most relevant to a question
+and stops at a token budget, so the prompt stays the same size too.
+``abuild_context`` does the same with async ORM queries, and ``index_version``
+tells answers built on different states of the index apart.
+"""
+import heapq
+import math
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from preprocessing.normalizer import get_normalizer
+from scraper.models import CleanedData, Prediction
+
+
+class Segment:
+    """Immutable postings for some CleanedData rows, highest impact first"""
+
+    def __init__(self, postings, doc_lengths, k1, b):
+        # postings: term -> [(doc_id, tf), ...]
+        self.doc_lengths = doc_lengths
+        self.doc_count = len(doc_lengths)
+        self.total_length = sum(doc_lengths.values())
+        avg_length = self.total_length / self.doc_count if self.doc_count else 1
+
+        def impact(posting):
+            doc_id, tf = posting
+            return tf / (tf + k1 * (1 - b + b * doc_lengths[doc_id] / avg_length))
+
+        self.postings = {}
+        for term, entries in postings.items():
+            entries.sort(key=impact, reverse=True)
+            self.postings[term] = (
+                array('q', [doc_id for doc_id, _ in entries]),
+                array('l', [tf for _, tf in entries]),
+            )
+
+    @classmethod
+    def from_rows(cls, rows, k1, b):
+        postings = defaultdict(list)
+        doc_lengths = {}
+        for doc_id, text in rows:
+            tokens = text.split()
+            for term, tf in Counter(tokens).items():
+                postings[term].append((doc_id, tf))
+            doc_lengths[doc_id] = len(tokens)
+        return cls(postings, doc_lengths, k1, b)
+
+    @classmethod
+    def merge(cls, first, second, k1, b):
+        postings = defaultdict(list)
+        for segment in (first, second):
+            for term, (ids, tfs) in segment.postings.items():
+                postings[term].extend(zip(ids, tfs))
+        return cls(postings, {**first.doc_lengths, **second.doc_lengths}, k1, b)
+
+    def df(self, term):
+        entry = self.postings.get(term)
+        return len(entry[0]) if entry else 0
+
+
+class ReviewIndex:
+    """Incremental BM25 index keyed by CleanedData id"""
+
+    def __init__(self, k1=1.5, b=0.75, max_postings=None, max_df=None, lookback=None):
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings or settings.ASK_INDEX_MAX_POSTINGS
+        self.max_df = max_df or settings.ASK_INDEX_MAX_DF
+        self.lookback = settings.ASK_INDEX_LOOKBACK if lookback is None else lookback
+        # Replaced, never mutated, so searches can use it without a lock
+        self.segments = ()
+        self.last_id = 0
+        self._refresh_lock = threading.Lock()
+
+    def indexed(self, doc_id):
+        return any(doc_id in segment.doc_lengths for segment in self.segments)
+
+    def missing_rows(self, start, batch_size):
+        """``(id, text)`` of rows between ``start`` and ``last_id`` not indexed yet"""
+        ids = [
+            doc_id for doc_id in
+            CleanedData.objects.filter(id__gt=start, id__lte=self.last_id)
+            .values_list('id', flat=True).iterator(chunk_size=batch_size)
+            if not self.indexed(doc_id)
+        ]
+        rows = []
+        for i in range(0, len(ids), batch_size):
+            rows.extend(
+                CleanedData.objects.filter(id__in=ids[i:i + batch_size])
+                .order_by('id')
+                .values_list('id', 'cleaned_text')
+            )
+        return rows
+
+    def refresh(self, batch_size=5000, segment_size=50000, full=False):
+        """Index CleanedData rows not indexed yet
+
+        Rows above the highest indexed id, plus any that committed late within
+        ``lookback`` ids below it, or anywhere below it with ``full``.
+        """
+        with self._refresh_lock:
+            last_id = self.last_id
+            start = 0 if full else max(0, last_id - self.lookback)
+            rows = self.missing_rows(start, batch_size)
+            while True:
+                batch = list(
+                    CleanedData.objects.filter(id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', 'cleaned_text')[:batch_size]
+                )
+                rows.extend(batch)
+                # Publish a segment at a time, so a first build of a large
+                # table is searchable as it goes
+                if rows and (not batch or len(rows) >= segment_size):
+                    self.add_segment(Segment.from_rows(rows, self.k1, self.b))
+                    # Late rows come first and may all be below it
+                    self.last_id = max(self.last_id, rows[-1][0])
+                    rows = []
+                if not batch:
+                    return
+                last_id = batch[-1][0]
+
+    def add_segment(self, segment):
+        segments = self.segments + (segment,)
+        # Merge equal-sized neighbours, so there are O(log n) segments and
+        # each review is re-sorted O(log n) times as the table grows
+        while len(segments) > 1 and segments[-1].doc_count >= segments[-2].doc_count:
+            merged = Segment.merge(segments[-2], segments[-1], self.k1, self.b)
+            segments = segments[:-2] + (merged,)
+        self.segments = segments
+
+    def search(self, terms, limit):
+        """Return up to ``limit`` ``(doc_id, score)`` pairs, best first"""
+        segments = self.segments
+        doc_count = sum(segment.doc_count for segment in segments)
+        if not doc_count:
+            return []
+        avg_length = sum(segment.total_length for segment in segments) / doc_count
+
+        dfs = {term: sum(segment.df(term) for segment in segments) for term in set(terms)}
+        dfs = {term: df for term, df in dfs.items() if df}
+        # Terms in most reviews barely change the ranking but have the
+        # longest postings; use them only if nothing rarer matched
+        rare = {term: df for term, df in dfs.items() if df <= self.max_df * doc_count}
+        if rare:
+            dfs = rare
+
+        k1, b = self.k1, self.b
+        scores = defaultdict(float)
+        for term, df in dfs.items():
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for segment in segments:
+                entry = segment.postings.get(term)
+                if entry is None:
+                    continue
+                ids, tfs = entry
+                lengths = segment.doc_lengths
+                # Highest impact first, so the cap only drops the weakest matches
+                for doc_id, tf in zip(ids[:self.max_postings], tfs[:self.max_postings]):
+                    norm = k1 * (1 - b + b * lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def refresh_forever(index, interval, reconcile_interval):
+    """Keep ``index`` up to date; runs in the review-index thread"""
+    # Started from AppConfig.ready(); don't query before app loading finishes
+    while not apps.ready:
+        time.sleep(0.1)
+    last_full = time.monotonic()
+    while True:
+        # This thread never sees request_finished, so recycle the connection here
+        close_old_connections()
+        try:
+            full = time.monotonic() - last_full >= reconcile_interval
+            index.refresh(full=full)
+            if full:
+                last_full = time.monotonic()
+        except DatabaseError:
+            # Dropped connection or similar; try again on the next pass
+            pass
+        finally:
+            close_old_connections()
+        time.sleep(interval)
+
+
+def get_review_index():
+    """Return the process-wide index, starting its refresh thread on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = ReviewIndex()
+                threading.Thread(
+                    target=refresh_forever,
+                    args=(index, settings.ASK_INDEX_REFRESH_SECONDS,
+                          settings.ASK_INDEX_RECONCILE_SECONDS),
+                    name='review-index', daemon=True).start()
+                _index = index
+    return _index
+
+
+def index_version():
+    """Reviews in the index so far; part of the answer cache key"""
+    # An answer built while the index was empty or still being built used
+    # the newest-reviews fallback, so it must not outlive that state
+    return sum(segment.doc_count for segment in get_review_index().segments)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def rank_reviews(question, top_k, index):
+    """CleanedData ids most relevant to ``question``, best first"""
+    # Questions go through the same cleaning as the indexed reviews
+    terms = get_normalizer().normalize(question).split()
+    # Ask for spare candidates: some reviews may not be scored yet
+    return [doc_id for doc_id, _ in index.search(terms, top_k * 2)]
+
+
+def ranked_predictions(ranked_ids):
+    return (
+        Prediction.objects.select_related('cleaned')
+        .filter(cleaned_id__in=ranked_ids)
+        .order_by('created_at', 'id')
+    )
+
+
+def newest_predictions(top_k):
+    return Prediction.objects.select_related('cleaned').order_by('-created_at', '-id')[:top_k]
+
+
+def pick_latest(predictions, ranked_ids):
+    # Later rows overwrite earlier ones: keep the latest prediction per review
+    by_cleaned = {p.cleaned_id: p for p in predictions}
+    return [by_cleaned[i] for i in ranked_ids if i in by_cleaned]
+
+
+def format_context(chosen, top_k, token_budget):
+    context_lines = []
+    used = 0
+    for p in chosen:
+        line = f"- {p.cleaned.cleaned_text[:50]}... | Sentiment: {p.sentiment}"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        context_lines.append(line)
+        used += cost
+        if len(context_lines) >= top_k:
+            break
+
+    return "\n".join(context_lines)
+
+
+def build_context(question, top_k=None, token_budget=None):
+    """Context lines for the reviews most relevant to ``question``"""
+    top_k = top_k or settings.ASK_CONTEXT_TOP_K
+    token_budget = token_budget or settings.ASK_CONTEXT_TOKEN_BUDGET
+
+    ranked_ids = rank_reviews(question, top_k, get_review_index())
+    if ranked_ids:
+        chosen = pick_latest(ranked_predictions(ranked_ids), ranked_ids)
+    else:
+        # Nothing matched the question; fall back to the newest reviews
+        chosen = list(newest_predictions(top_k))
+    return format_context(chosen, top_k, token_budget)
+
+
+async def abuild_context(question, top_k=None, token_budget=None):
+    """Async version of build_context()"""
+    top_k = top_k or settings.ASK_CONTEXT_TOP_K
+    token_budget = token_budget or settings.ASK_CONTEXT_TOKEN_BUDGET
+
+    # Normalising the question and BM25 scoring are CPU work; keep them off the event loop
+    ranked_ids = await sync_to_async(
+        lambda: rank_reviews(question, top_k, get_review_index()))()
+    if ranked_ids:
+        chosen = pick_latest([p async for p in ranked_predictions(ranked_ids)], ranked_ids)
+    else:
+        chosen = [p async for p in newest_predictions(top_k)]
+    return format_context(chosen, top_k, token_budget)
@@ -1,3 +1,507 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from scraper.models import CleanedData, Prediction, ScrapedData, content_hash
+from smart_text_pipeline import metrics
+
+from . import llm
+from .llm import get_answer_cache
+from .retrieval import ReviewIndex
+
+
+STREAMED_PIECES = ['Héllo', ' wörld ', '😀']
+
+
+class StubGeminiHandler(BaseHTTPRequestHandler):
+    """Answers generateContent and streamGenerateContent like Gemini does"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests += 1
+            status = self.server.failures.pop(0) if self.server.failures else 200
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        try:
+            time.sleep(self.server.delay)
+            if status == 200:
+                self.respond(body)
+            else:
+                self.fail(status)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def respond(self, body):
+        if 'streamGenerateContent' in self.path:
+            # Chunked SSE of raw UTF-8 without a charset, as Gemini sends it
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for piece in STREAMED_PIECES:
+                event = 'data: ' + json.dumps(
+                    {'candidates': [{'content': {'parts': [{'text': piece}]}}]},
+                    ensure_ascii=False) + '\r\n\r\n'
+                self.write_chunk(event.encode('utf-8'))
+            self.write_chunk(b'')
+            return
+
+        prompt = body['contents'][0]['parts'][0]['text']
+        out = json.dumps({'candidates': [{'content': {'parts': [{'text': f'echo: {prompt}'}]}}]})
+        out = out.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def fail(self, status):
+        out = json.dumps({'error': {'code': status}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubGeminiTestCase(SimpleTestCase):
+    """Points the Gemini client at a local stub server"""
+
+    delay = 0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGeminiHandler)
+        cls.server.daemon_threads = True
+        cls.server.delay = cls.delay
+        cls.server.lock = threading.Lock()
+        cls.server.in_flight = cls.server.max_in_flight = 0
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.enterClassContext(override_settings(
+            GEMINI_API_BASE=f'http://127.0.0.1:{cls.server.server_port}',
+            GEMINI_API_KEY='test-key',
+        ))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        # Statuses to answer the next requests with, before succeeding again
+        self.server.failures = []
+        self.server.requests = 0
+
+
+class StreamGenerateTests(StubGeminiTestCase):
+    def test_stream_is_decoded_as_utf8(self):
+        self.assertEqual(list(llm.stream_generate('question')), STREAMED_PIECES)
+
+
+# With the default GEMINI_MAX_RETRIES of 2
+class RetryTests(StubGeminiTestCase):
+    def test_server_errors_are_retried(self):
+        self.server.failures = [503, 500]
+        self.assertEqual(llm.generate('question'), 'echo: question')
+        self.assertEqual(self.server.requests, 3)
+
+    def test_retries_are_bounded(self):
+        self.server.failures = [503] * 5
+        with self.assertRaisesMessage(llm.LLMError, 'returned 503'):
+            llm.generate('question')
+        self.assertEqual(self.server.requests, 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.failures = [400]
+        with self.assertRaisesMessage(llm.LLMError, 'returned 400'):
+            llm.generate('question')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_async_server_errors_are_retried(self):
+        self.server.failures = [429]
+        self.assertEqual(asyncio.run(llm.agenerate('question')), 'echo: question')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_async_client_errors_are_not_retried(self):
+        self.server.failures = [403]
+        with self.assertRaisesMessage(llm.LLMError, 'returned 403'):
+            asyncio.run(llm.agenerate('question'))
+        self.assertEqual(self.server.requests, 1)
+
+
+@override_settings(GEMINI_MAX_IN_FLIGHT=10)
+class AsyncGenerateTests(StubGeminiTestCase):
+    delay = 0.3
+
+    def test_concurrent_calls_overlap_up_to_the_cap(self):
+        async def ask_all():
+            return await asyncio.gather(*(llm.agenerate(f'q{i}') for i in range(30)))
+
+        started = time.perf_counter()
+        answers = asyncio.run(ask_all())
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(answers, [f'echo: q{i}' for i in range(30)])
+        self.assertLessEqual(self.server.max_in_flight, 10)
+        self.assertGreater(self.server.max_in_flight, 1)
+        # Three waves of ten, not thirty calls in a row
+        self.assertLess(elapsed, 30 * self.delay / 2)
+
+    def test_client_is_closed_with_its_loop(self):
+        clients = []
+
+        async def ask():
+            clients.append(await llm.get_async_client())
+            return await llm.agenerate('question')
+
+        # async_to_sync runs each call on a new loop, like an async view under WSGI
+        for _ in range(2):
+            self.assertEqual(async_to_sync(ask)(), 'echo: question')
+        self.assertEqual(len(clients), 2)
+        self.assertNotEqual(clients[0], clients[1])
+        self.assertTrue(all(client.http.is_closed for client in clients))
+
+
+def create_prediction(text, sentiment='POSITIVE'):
+    scraped = ScrapedData.objects.create(
+        source_url='https://www.imdb.com/review', review_title=f'{text} title', raw_text=text)
+    cleaned = CleanedData.objects.create(scraped=scraped, cleaned_text=text.lower())
+    return Prediction.objects.create(cleaned=cleaned, sentiment=sentiment)
+
+
+class PredictionsListTests(TestCase):
+    def get(self, **params):
+        return self.client.get('/api/predictions/', params)
+
+    def test_cursor_is_stable_across_inserts(self):
+        first = [create_prediction(f'Review {i}') for i in range(5)]
+        page = self.get(page_size=2, fields='id').json()
+        self.assertEqual([row['id'] for row in page['results']], [p.id for p in first[:2]])
+
+        # Inserted while the client pages: one sorting before the cursor, one after
+        earlier = create_prediction('Backdated review')
+        Prediction.objects.filter(pk=earlier.pk).update(created_at=first[0].created_at - timedelta(days=1))
+        later = create_prediction('Newer review')
+
+        seen = [row['id'] for row in page['results']]
+        while page['next_cursor']:
+            page = self.get(page_size=2, fields='id', cursor=page['next_cursor']).json()
+            seen += [row['id'] for row in page['results']]
+        self.assertEqual(seen, [p.id for p in first] + [later.id])
+
+    def test_invalid_cursor_is_rejected(self):
+        create_prediction('Review')
+        bad_timestamp = base64.urlsafe_b64encode(b'yesterday|1').decode()
+        for cursor in ('not-a-cursor', bad_timestamp):
+            res = self.get(cursor=cursor)
+            self.assertEqual(res.status_code, 400, cursor)
+            self.assertEqual(res.json()['error'], 'Invalid cursor')
+
+    def test_fields_are_projected_and_unknown_ones_rejected(self):
+        create_prediction('Review', sentiment='NEGATIVE')
+        res = self.get(fields='title,sentiment')
+        self.assertEqual(res.json()['results'], [{'title': 'Review title', 'sentiment': 'NEGATIVE'}])
+
+        res = self.get(fields='title,password,cleaned__scraped__raw_text')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json()['error'], 'Unknown fields: password, cleaned__scraped__raw_text')
+
+    def test_jsonl_export_streams_one_object_per_line(self):
+        predictions = [create_prediction(f'Review {i}') for i in range(3)]
+        res = self.get(export='jsonl', fields='id,cleaned_text,created_at')
+
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        body = b''.join(res.streaming_content).decode()
+        self.assertTrue(body.endswith('\n'))
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(rows, [
+            {'id': p.id, 'cleaned_text': f'review {i}',
+             'created_at': DjangoJSONEncoder().default(p.created_at)}
+            for i, p in enumerate(predictions)
+        ])
+
+
+class PredictionStatsTests(TestCase):
+    def test_out_of_range_datetime_is_rejected(self):
+        res = self.client.get('/api/predictions/stats/', {'since': '2020-13-45T00:00:00'})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('since', res.json()['error'])
+
+
+class ReviewIndexTests(TestCase):
+    def cleaned(self, pk, text):
+        scraped = ScrapedData.objects.create(source_url='https://www.imdb.com/review', raw_text=text)
+        return CleanedData.objects.create(pk=pk, scraped=scraped, cleaned_text=text)
+
+    def found(self, index, term):
+        return [doc_id for doc_id, _ in index.search([term], 10)]
+
+    def test_rows_committed_out_of_id_order_are_indexed(self):
+        index = ReviewIndex()
+        self.cleaned(10, 'awful film')
+        index.refresh()
+        # Committed after the refresh, with a lower id
+        self.cleaned(5, 'great film')
+        index.refresh()
+
+        self.assertEqual(self.found(index, 'great'), [5])
+        self.assertEqual(sorted(self.found(index, 'film')), [5, 10])
+
+    def test_full_refresh_finds_rows_beyond_the_lookback(self):
+        index = ReviewIndex(lookback=0)
+        self.cleaned(10, 'awful film')
+        index.refresh()
+        self.cleaned(5, 'great film')
+        index.refresh()
+        self.assertEqual(self.found(index, 'great'), [])
+
+        index.refresh(full=True)
+        self.assertEqual(self.found(index, 'great'), [5])
+        self.assertEqual(sorted(self.found(index, 'film')), [5, 10])
+
+
+class LowercaseNormalizer:
+    """Stands in for TextNormalizer where only the data flow matters"""
+
+    def normalize(self, text):
+        return text.lower()
+
+
+class AskTestCase(StubGeminiTestCase, TestCase):
+    """Asks against the stub server, with an index the test refreshes itself"""
+
+    def setUp(self):
+        super().setUp()
+        get_answer_cache().clear()
+        self.index = ReviewIndex()
+        for target, value in (('get_review_index', lambda: self.index),
+                              ('get_normalizer', LowercaseNormalizer)):
+            patcher = mock.patch(f'api.retrieval.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def review(self, text, sentiment='POSITIVE'):
+        return create_prediction(text, sentiment)
+
+    def ask(self, question='was the film great'):
+        return self.client.post('/api/ask/', {'question': question}, content_type='application/json')
+
+
+class AnswerCacheTests(AskTestCase):
+    def test_answer_from_before_the_index_was_built_is_not_reused(self):
+        self.review('great film')
+        # Index still empty: the context falls back to the newest reviews
+        self.assertFalse(self.ask().json()['cached'])
+        self.assertTrue(self.ask().json()['cached'])
+
+        self.index.refresh()
+        self.assertFalse(self.ask().json()['cached'])
+        self.assertTrue(self.ask().json()['cached'])
+
+    def test_repeated_question_is_a_cache_hit(self):
+        self.review('great film')
+        first = self.ask('Was the film great?').json()
+        second = self.ask('  was the FILM   great?').json()
+
+        self.assertFalse(first['cached'])
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['answer'], first['answer'])
+        self.assertEqual(self.server.requests, 1)
+
+    def test_new_prediction_is_a_miss(self):
+        self.review('great film')
+        self.index.refresh()
+        self.ask()
+        # Same index, new prediction data
+        self.review('awful film', sentiment='NEGATIVE')
+
+        self.assertFalse(self.ask().json()['cached'])
+        self.assertEqual(self.server.requests, 2)
+
+
+class AskValidationTests(AskTestCase):
+    def test_non_string_question_is_rejected(self):
+        for url in ('/api/ask/', '/api/ask/async/'):
+            for question in (123, ['a'], {'q': 'a'}):
+                res = self.client.post(url, {'question': question}, content_type='application/json')
+                self.assertEqual(res.status_code, 400, (url, question))
+                self.assertEqual(res.json()['error'], 'question must be a string')
+        self.assertEqual(self.server.requests, 0)
+
+
+@override_settings(SENTIMENT_MODELS={'stub': {'backend': 'stub', 'model': 'org/stub'}})
+class PredictBatchTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('api.views.get_normalizer', LowercaseNormalizer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def predict(self, texts):
+        res = self.client.post(
+            '/api/predict/batch/', {'texts': texts, 'model_name': 'stub'}, content_type='application/json')
+        self.assertEqual(res.status_code, 200, res.content)
+        return res.json()['results']
+
+    def test_results_follow_the_request_order(self):
+        texts = ['An AWFUL film', 'A great film', 'Boring and bad', 'Superb']
+        results = self.predict(texts)
+
+        self.assertEqual([r['cleaned_text'] for r in results], [t.lower() for t in texts])
+        self.assertEqual([r['sentiment'] for r in results], ['NEGATIVE', 'POSITIVE', 'NEGATIVE', 'POSITIVE'])
+
+    def test_duplicates_in_one_batch_share_one_row_set(self):
+        results = self.predict(['A great film', 'An awful film', 'a  GREAT film', 'A great film'])
+
+        self.assertEqual([r['sentiment'] for r in results], ['POSITIVE', 'NEGATIVE', 'POSITIVE', 'POSITIVE'])
+        self.assertEqual(results[0], results[3])
+        # 'a  GREAT film' has the same content hash as 'A great film'
+        self.assertEqual(ScrapedData.objects.count(), 2)
+        self.assertEqual(CleanedData.objects.count(), 2)
+        self.assertEqual(Prediction.objects.count(), 2)
+
+    def test_rows_from_earlier_requests_are_reused(self):
+        self.predict(['A great film'])
+        self.client.post('/api/predict/', {'text': 'An awful film', 'model_name': 'stub'},
+                         content_type='application/json')
+        before = [model.objects.count() for model in (ScrapedData, CleanedData, Prediction)]
+
+        results = self.predict(['An awful film', 'A great film'])
+        self.assertEqual([r['sentiment'] for r in results], ['NEGATIVE', 'POSITIVE'])
+        self.assertEqual([model.objects.count() for model in (ScrapedData, CleanedData, Prediction)], before)
+
+    def test_reused_prediction_is_not_rerun(self):
+        self.predict(['A great film'])
+        # A stored sentiment wins over the model for a text already predicted
+        Prediction.objects.update(sentiment='NEGATIVE')
+        self.assertEqual(self.predict(['A great film', 'Superb'])[0]['sentiment'], 'NEGATIVE')
+        self.assertEqual(Prediction.objects.count(), 2)
+
+
+class RacingNormalizer(LowercaseNormalizer):
+    """Saves the text the way a concurrent request would, while this one cleans it"""
+
+    def normalize(self, text):
+        cleaned = text.lower()
+        scraped, _ = ScrapedData.objects.get_or_create(
+            source_url='manual', content_hash=content_hash(text),
+            defaults={'review_title': 'Manual Input', 'raw_text': text})
+        cleaned_row, _ = CleanedData.objects.get_or_create(
+            scraped=scraped, cleaning_version=settings.CLEANING_VERSION,
+            defaults={'cleaned_text': cleaned})
+        Prediction.objects.get_or_create(
+            cleaned=cleaned_row, model_name='stub', defaults={'sentiment': 'POSITIVE'})
+        return cleaned
+
+
+@override_settings(SENTIMENT_MODELS={'stub': {'backend': 'stub', 'model': 'org/stub'}})
+@mock.patch('api.views.get_normalizer', RacingNormalizer)
+class ConcurrentPredictTests(TestCase):
+    def post(self, url, data):
+        res = self.client.post(url, {**data, 'model_name': 'stub'}, content_type='application/json')
+        self.assertEqual(res.status_code, 200, res.content)
+        return res.json()
+
+    def assertOneRowSet(self):
+        self.assertEqual(
+            [model.objects.count() for model in (ScrapedData, CleanedData, Prediction)], [1, 1, 1])
+
+    def test_batch_request_losing_the_race_adds_no_rows(self):
+        results = self.post('/api/predict/batch/', {'texts': ['A great film']})['results']
+        self.assertEqual(results, [{'cleaned_text': 'a great film', 'sentiment': 'POSITIVE'}])
+        self.assertOneRowSet()
+
+    def test_single_request_losing_the_race_adds_no_rows(self):
+        ScrapedData.objects.create(
+            source_url='manual', review_title='Manual Input', raw_text='A great film')
+        self.assertEqual(self.post('/api/predict/', {'text': 'A great film'})['sentiment'], 'POSITIVE')
+        self.assertOneRowSet()
+
+
+def sample(metric, name, **labels):
+    """Current value of one sample of ``metric``, 0 before the first update"""
+    wanted = {key: str(value) for key, value in labels.items()}
+    for sample_name, key, value in metric.samples():
+        if sample_name == name and {k: str(v) for k, v in key} == wanted:
+            return value
+    return 0
+
+
+class MetricsTests(SimpleTestCase):
+    def test_record_batch_moves_counters_and_histograms(self):
+        rows = sample(metrics.ROWS, 'stp_rows_total', stage='test')
+        sizes = sample(metrics.BATCH_SIZE, 'stp_batch_size_count', stage='test')
+        small = sample(metrics.BATCH_SIZE, 'stp_batch_size_bucket', stage='test', le=2)
+        fits = sample(metrics.BATCH_SIZE, 'stp_batch_size_bucket', stage='test', le=4)
+        rate = sample(metrics.ROWS_PER_SECOND, 'stp_rows_per_second_sum', stage='test')
+
+        metrics.record_batch('test', 4, 0.5)
+
+        self.assertEqual(sample(metrics.ROWS, 'stp_rows_total', stage='test'), rows + 4)
+        self.assertEqual(sample(metrics.BATCH_SIZE, 'stp_batch_size_count', stage='test'), sizes + 1)
+        self.assertEqual(sample(metrics.BATCH_SIZE, 'stp_batch_size_bucket', stage='test', le=2), small)
+        self.assertEqual(sample(metrics.BATCH_SIZE, 'stp_batch_size_bucket', stage='test', le=4), fits + 1)
+        self.assertEqual(sample(metrics.ROWS_PER_SECOND, 'stp_rows_per_second_sum', stage='test'), rate + 8)
+
+    def test_timer_observes_the_stage(self):
+        count = sample(metrics.STAGE_SECONDS, 'stp_stage_seconds_count', stage='test.timer')
+
+        with metrics.timer('test.timer'):
+            time.sleep(0.01)
+
+        self.assertEqual(
+            sample(metrics.STAGE_SECONDS, 'stp_stage_seconds_count', stage='test.timer'), count + 1)
+        self.assertGreaterEqual(
+            sample(metrics.STAGE_SECONDS, 'stp_stage_seconds_sum', stage='test.timer'), 0.01)
+        self.assertIn('stp_stage_seconds_count{stage="test.timer"}', metrics.render())
+
+
+@override_settings(SENTIMENT_MODELS={'stub': {'backend': 'stub', 'model': 'org/stub'}})
+@mock.patch('api.views.get_normalizer', LowercaseNormalizer)
+class ServerTimingTests(TestCase):
+    def predict(self):
+        res = self.client.post(
+            '/api/predict/', {'text': 'A great film', 'model_name': 'stub'}, content_type='application/json')
+        self.assertEqual(res.status_code, 200, res.content)
+        return res
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_request_stages_are_reported(self):
+        requests = sample(metrics.HTTP_SECONDS, 'stp_http_request_seconds_count',
+                          view='predict_text', method='POST')
+
+        entries = [entry.split(';')[0] for entry in self.predict()['Server-Timing'].split(', ')]
+        self.assertEqual(entries[-1], 'total')
+        for stage in ('predict.db_read', 'predict.clean', 'predict.db_write', 'predict.inference'):
+            self.assertIn(stage, entries)
+        self.assertEqual(
+            sample(metrics.HTTP_SECONDS, 'stp_http_request_seconds_count', view='predict_text', method='POST'),
+            requests + 1)
+
+    @override_settings(METRICS_SERVER_TIMING=False)
+    def test_header_is_only_sent_when_enabled(self):
+        self.assertNotIn('Server-Timing', self.predict())
@@ -1,10 +1,18 @@
 # api/urls.py
 
 from django.urls import path
-from .views import PredictionsAPIView, AskGeminiAPIView, PredictTextAPIView
+from .views import (
+    PredictionsAPIView, PredictionStatsAPIView, AskGeminiAPIView, PredictTextAPIView,
+    PredictBatchAPIView, AskGeminiAsyncView, MetricsView,
+)
 
 urlpatterns = [
     path('predictions/', PredictionsAPIView.as_view(), name='predictions'),
+    path('predictions/stats/', PredictionStatsAPIView.as_view(), name='prediction_stats'),
     path('ask/', AskGeminiAPIView.as_view(), name='ask_gemini'),
+    # Non-blocking variant for ASGI deployments
+    path('ask/async/', AskGeminiAsyncView.as_view(), name='ask_gemini_async'),
     path('predict/', PredictTextAPIView.as_view(), name='predict_text'),
+    path('predict/batch/', PredictBatchAPIView.as_view(), name='predict_batch'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
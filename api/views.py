@@ -1,81 +1,329 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.utils.dateparse import parse_datetime
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from scraper.models import Prediction
-from scraper.models import CleanedData, ScrapedData, InferenceLog
-from transformers import pipeline
-import requests
-import os
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-import string
+from scraper.models import CleanedData, ScrapedData, InferenceLog, content_hash
+from ml_model.batching import get_batcher
+from ml_model.scheduling import get_scheduler
+from preprocessing.normalizer import get_normalizer
+from smart_text_pipeline import metrics
+from smart_text_pipeline.metrics import timer
+from .pagination import after_cursor, encode_cursor
+from .llm import (
+    LLMError, adata_version, agenerate, answer_cache_key, astream_generate, build_prompt,
+    data_version, generate, get_answer_cache, stream_generate,
+)
+from .retrieval import abuild_context, build_context, index_version
+import json
+import time
+
+
+# Response field -> ORM lookup for PredictionsAPIView
+PREDICTION_FIELDS = {
+    'id': 'id',
+    'title': 'cleaned__scraped__review_title',
+    'raw_text': 'cleaned__scraped__raw_text',
+    'cleaned_text': 'cleaned__cleaned_text',
+    'sentiment': 'sentiment',
+    'model_name': 'model_name',
+    'created_at': 'created_at',
+}
+DEFAULT_PREDICTION_FIELDS = ['title', 'raw_text', 'cleaned_text', 'sentiment']
 
 
 class PredictionsAPIView(APIView):
+    """
+    Predictions in ``(created_at, id)`` order, one page at a time.
+
+    Query parameters:
+    - ``cursor``: ``next_cursor`` from the previous page
+    - ``page_size``: rows per page, capped at PREDICTIONS_MAX_PAGE_SIZE
+    - ``fields``: comma-separated subset of PREDICTION_FIELDS
+    - ``export=jsonl``: stream every matching row as JSON lines instead
+    """
+
+    def get(self, request):
+        fields = request.query_params.get('fields')
+        fields = fields.split(',') if fields else DEFAULT_PREDICTION_FIELDS
+        unknown = [f for f in fields if f not in PREDICTION_FIELDS]
+        if unknown:
+            return Response({'error': f"Unknown fields: {', '.join(unknown)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Only the requested columns are read; created_at and id drive the cursor
+        lookups = {PREDICTION_FIELDS[f] for f in fields} | {'id', 'created_at'}
+        predictions = Prediction.objects.order_by('created_at', 'id')
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                predictions = after_cursor(predictions, cursor)
+            except ValueError:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        predictions = predictions.values(*lookups)
+
+        if request.query_params.get('export') == 'jsonl':
+            return StreamingHttpResponse(
+                self.stream_jsonl(predictions, fields),
+                content_type='application/x-ndjson')
+
+        try:
+            page_size = int(request.query_params.get('page_size', settings.PREDICTIONS_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'page_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = max(1, min(page_size, settings.PREDICTIONS_MAX_PAGE_SIZE))
+
+        # One extra row tells us whether there is a next page
+        rows = list(predictions[:page_size + 1])
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+        data = [
+            {f: row[PREDICTION_FIELDS[f]] for f in fields}
+            for row in rows
+        ]
+        return Response({"results": data, "next_cursor": next_cursor})
+
+    def stream_jsonl(self, predictions, fields):
+        # iterator() uses a server-side cursor on PostgreSQL, so the export
+        # never holds more than one chunk of rows in memory
+        for row in predictions.iterator(chunk_size=2000):
+            item = {f: row[PREDICTION_FIELDS[f]] for f in fields}
+            yield json.dumps(item, cls=DjangoJSONEncoder) + "\n"
+
+
+# Time buckets supported by PredictionStatsAPIView
+STATS_BUCKETS = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+class PredictionStatsAPIView(APIView):
+    """
+    Prediction counts per sentiment, computed with GROUP BY in the database.
+
+    Query parameters (all optional):
+    - ``model_name``, ``source_url``: exact-match filters
+    - ``since``, ``until``: ISO 8601 bounds on ``created_at`` (until is exclusive)
+    - ``bucket``: one of STATS_BUCKETS to also return counts per time bucket
+    """
+
     def get(self, request):
-        predictions = Prediction.objects.select_related(
-            'cleaned__scraped').all()
-        data = []
-        for p in predictions:
-            data.append({
-                "title": p.cleaned.scraped.review_title,
-                "raw_text": p.cleaned.scraped.raw_text,
-                "cleaned_text": p.cleaned.cleaned_text,
-                "sentiment": p.sentiment,
-            })
+        params = request.query_params
+        predictions = Prediction.objects.all()
+
+        if params.get('model_name'):
+            predictions = predictions.filter(model_name=params['model_name'])
+        if params.get('source_url'):
+            predictions = predictions.filter(cleaned__scraped__source_url=params['source_url'])
+
+        for name, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            if params.get(name):
+                try:
+                    value = parse_datetime(params[name])
+                except ValueError:
+                    # Well formed but out of range, e.g. month 13
+                    value = None
+                if value is None:
+                    return Response({'error': f'{name} must be an ISO 8601 datetime'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                predictions = predictions.filter(**{lookup: value})
+
+        bucket = params.get('bucket')
+        if bucket and bucket not in STATS_BUCKETS:
+            return Response({'error': f"bucket must be one of: {', '.join(STATS_BUCKETS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        counts = dict(
+            predictions.values_list('sentiment')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        data = {"total": sum(counts.values()), "counts": counts}
+
+        if bucket:
+            rows = (
+                predictions.annotate(bucket=STATS_BUCKETS[bucket]('created_at'))
+                .values_list('bucket', 'sentiment')
+                .annotate(count=Count('id'))
+                .order_by('bucket')
+            )
+            buckets = {}
+            for start, sentiment, count in rows:
+                buckets.setdefault(start, {})[sentiment] = count
+            data["buckets"] = [
+                {"start": start, "counts": bucket_counts}
+                for start, bucket_counts in buckets.items()
+            ]
+
         return Response(data)
 
 
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Server-sent events: ``data: {"text": ...}`` per piece of the answer,
+    then ``event: done`` (or ``event: error``)"""
+    response = StreamingHttpResponse(events, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class AskGeminiAPIView(APIView):
     def post(self, request):
         question = request.data.get('question')
         if not question:
             return Response({'error': 'No question provided'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        cleaned_and_preds = Prediction.objects.select_related('cleaned__scraped').all()
+        if not isinstance(question, str):
+            return Response({'error': 'question must be a string'}, status=status.HTTP_400_BAD_REQUEST)
 
-        context_lines = []
-        for p in cleaned_and_preds:
-            context_lines.append(
-                f"- {p.cleaned.cleaned_text[:50]}... | Sentiment: {p.sentiment}"
-            )
+        # Repeated questions are answered from cache until the data changes
+        answer_cache = get_answer_cache()
+        cache_key = answer_cache_key(question, data_version(), index_version())
+        answer = answer_cache.get(cache_key)
+        cached = answer is not None
+        metrics.CACHE_REQUESTS.inc(cache='answers', result='hit' if cached else 'miss')
+
+        prompt = None
+        if not cached:
+            # Only the reviews most relevant to the question, within a token budget
+            with timer('ask.context'):
+                context = build_context(question)
+            prompt = build_prompt(question, context)
+        if request.data.get('stream'):
+            return sse_response(self.stream_events(question, cache_key, answer, prompt))
+
+        if not cached:
+            try:
+                with timer('ask.llm'):
+                    answer = generate(prompt)
+            except LLMError:
+                return Response({"error": "Gemini API error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            answer_cache.set(cache_key, answer, settings.ASK_CACHE_TTL)
+
+        InferenceLog.objects.create(
+            question=question,
+            answer=answer
+        )
+        return Response({"answer": answer, "cached": cached})
 
-        context = "\n".join(context_lines)
+    def stream_events(self, question, cache_key, answer, prompt):
+        """Relay the answer as it arrives; the log row is written once it is complete"""
+        cached = answer is not None
+        if cached:
+            yield sse_event({"text": answer})
+        else:
+            pieces = []
+            started = time.perf_counter()
+            try:
+                for piece in stream_generate(prompt):
+                    if not pieces:
+                        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='ask.first_token')
+                    pieces.append(piece)
+                    yield sse_event({"text": piece})
+            except LLMError:
+                yield sse_event({"error": "Gemini API error"}, event='error')
+                return
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='ask.llm')
+            answer = ''.join(pieces)
+            get_answer_cache().set(cache_key, answer, settings.ASK_CACHE_TTL)
 
-        # ✅ Compose the full prompt for Gemini
-        prompt = f"""
-        You are an assistant analyzing movie reviews.
+        InferenceLog.objects.create(
+            question=question,
+            answer=answer
+        )
+        yield sse_event({"cached": cached}, event='done')
 
-        Context:
-        Here is the list of cleaned reviews with predicted sentiments:
-        {context}
 
-        Question:
-        {question}
-        """
+# Same contract as AskGeminiAPIView, but served from the event loop under ASGI:
+# waiting on Gemini doesn't hold a worker thread. DRF views are sync-only, and
+# like them this one doesn't use session CSRF.
+@method_decorator(csrf_exempt, name='dispatch')
+class AskGeminiAsyncView(View):
+    async def post(self, request):
+        try:
+            body = json.loads(request.body or b'{}')
+            question = body.get('question')
+        except (ValueError, AttributeError):
+            body, question = {}, None
+        if not question:
+            return JsonResponse({'error': 'No question provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(question, str):
+            return JsonResponse({'error': 'question must be a string'}, status=status.HTTP_400_BAD_REQUEST)
 
+        answer_cache = get_answer_cache()
+        cache_key = answer_cache_key(question, await adata_version(), index_version())
+        answer = await answer_cache.aget(cache_key)
+        cached = answer is not None
+        metrics.CACHE_REQUESTS.inc(cache='answers', result='hit' if cached else 'miss')
 
-        GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}"
+        prompt = None
+        if not cached:
+            with timer('ask.context'):
+                context = await abuild_context(question)
+            prompt = build_prompt(question, context)
+        if body.get('stream'):
+            return sse_response(self.stream_events(question, cache_key, answer, prompt))
 
-        payload = {
-            "contents": [
-                {"parts": [{"text": prompt}]}
-            ]
-        }
-        res = requests.post(url, json=payload)
+        if not cached:
+            try:
+                with timer('ask.llm'):
+                    answer = await agenerate(prompt)
+            except LLMError:
+                return JsonResponse({"error": "Gemini API error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            await answer_cache.aset(cache_key, answer, settings.ASK_CACHE_TTL)
 
-        if res.status_code == 200:
-            answer = res.json()['candidates'][0]['content']['parts'][0]['text']
-            InferenceLog.objects.create(
-                question=question,
-                answer=answer
-            )
-            return Response({"answer": answer})
+        await InferenceLog.objects.acreate(
+            question=question,
+            answer=answer
+        )
+        return JsonResponse({"answer": answer, "cached": cached})
+
+    async def stream_events(self, question, cache_key, answer, prompt):
+        cached = answer is not None
+        if cached:
+            yield sse_event({"text": answer})
         else:
-            return Response({"error": "Gemini API error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            pieces = []
+            started = time.perf_counter()
+            try:
+                async for piece in astream_generate(prompt):
+                    if not pieces:
+                        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='ask.first_token')
+                    pieces.append(piece)
+                    yield sse_event({"text": piece})
+            except LLMError:
+                yield sse_event({"error": "Gemini API error"}, event='error')
+                return
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='ask.llm')
+            answer = ''.join(pieces)
+            await get_answer_cache().aset(cache_key, answer, settings.ASK_CACHE_TTL)
+
+        await InferenceLog.objects.acreate(
+            question=question,
+            answer=answer
+        )
+        yield sse_event({"cached": cached}, event='done')
 
 
 class PredictTextAPIView(APIView):
@@ -84,40 +332,174 @@ class PredictTextAPIView(APIView):
         if not text:
             return Response({'error': 'No text provided'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Preprocess with NLTK
-        lemmatizer = WordNetLemmatizer()
-        stop_words = set(stopwords.words('english'))
-
-        text_clean = text.lower()
-        text_clean = text_clean.translate(
-            str.maketrans('', '', string.punctuation))
-        tokens = word_tokenize(text_clean)
-        tokens = [lemmatizer.lemmatize(word)
-                  for word in tokens if word not in stop_words]
-        cleaned_text = " ".join(tokens)
-
-        # Save to DB for traceability
-        scraped = ScrapedData.objects.create(
-            source_url='manual',
-            review_title='Manual Input',
-            raw_text=text
-        )
-        cleaned = CleanedData.objects.create(
-            scraped=scraped,
-            cleaned_text=cleaned_text
-        )
+        model_name = request.data.get('model_name') or settings.SENTIMENT_DEFAULT_MODEL
+        try:
+            batcher = get_batcher(model_name)
+        except LookupError:
+            return Response({'error': f'Unknown model: {model_name}'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Run BERT
-        classifier = pipeline('sentiment-analysis')
-        result = classifier(cleaned_text[:512])
-        sentiment = result[0]['label']
+        # Save to DB for traceability; a text seen before reuses its rows,
+        # so duplicates are neither re-cleaned nor re-classified
+        with timer('predict.db_read'):
+            scraped, _ = ScrapedData.objects.get_or_create(
+                source_url='manual',
+                content_hash=content_hash(text),
+                defaults={'review_title': 'Manual Input', 'raw_text': text}
+            )
+            cleaned = CleanedData.objects.filter(
+                scraped=scraped, cleaning_version=settings.CLEANING_VERSION).first()
+        if cleaned is None:
+            # Preprocess with NLTK (shared, memoized normalizer)
+            with timer('predict.clean'):
+                cleaned_text = get_normalizer().normalize(text)
+            with timer('predict.db_write'):
+                # A concurrent request for the same text may have won the insert
+                cleaned, _ = CleanedData.objects.get_or_create(
+                    scraped=scraped,
+                    cleaning_version=settings.CLEANING_VERSION,
+                    defaults={'cleaned_text': cleaned_text},
+                )
+        cleaned_text = cleaned.cleaned_text
 
-        Prediction.objects.create(
-            cleaned=cleaned,
-            sentiment=sentiment
-        )
+        with timer('predict.db_read'):
+            prediction = Prediction.objects.filter(cleaned=cleaned, model_name=model_name).first()
+        if prediction is None:
+            # Run BERT; concurrent requests share one batched model call
+            with timer('predict.inference'):
+                result = batcher.predict(cleaned_text)
+            with timer('predict.db_write'), transaction.atomic():
+                # Lock the review, then look again: a concurrent request for
+                # the same text may have saved its prediction meanwhile
+                CleanedData.objects.select_for_update().get(pk=cleaned.pk)
+                prediction = Prediction.objects.filter(cleaned=cleaned, model_name=model_name).first()
+                if prediction is None:
+                    prediction = Prediction.objects.create(
+                        cleaned=cleaned,
+                        sentiment=result['label'],
+                        model_name=model_name
+                    )
+        sentiment = prediction.sentiment
 
         return Response({
             "cleaned_text": cleaned_text,
             "sentiment": sentiment
         })
+
+
+class PredictBatchAPIView(APIView):
+    def post(self, request):
+        texts = request.data.get('texts')
+        if not isinstance(texts, list) or not texts:
+            return Response({'error': 'No texts provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(text, str) and text for text in texts):
+            return Response({'error': 'Every text must be a non-empty string'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(texts) > settings.PREDICT_BATCH_MAX_TEXTS:
+            return Response({'error': f'At most {settings.PREDICT_BATCH_MAX_TEXTS} texts per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        model_name = request.data.get('model_name') or settings.SENTIMENT_DEFAULT_MODEL
+        try:
+            scheduler = get_scheduler(model_name)
+        except LookupError:
+            return Response({'error': f'Unknown model: {model_name}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Same dedupe as /api/predict/: one row set per distinct text
+        hashes = [content_hash(text) for text in texts]
+        unique = {}
+        for digest, text in zip(hashes, texts):
+            unique.setdefault(digest, text)
+
+        # Rows left over from earlier requests
+        with timer('predict_batch.db_read'):
+            scraped = {
+                row.content_hash: row
+                for row in ScrapedData.objects.filter(source_url='manual', content_hash__in=list(unique))
+            }
+            cleaned = {
+                row.scraped.content_hash: row
+                for row in CleanedData.objects.filter(
+                    scraped__in=list(scraped.values()), cleaning_version=settings.CLEANING_VERSION
+                ).select_related('scraped')
+            }
+            predicted = dict(
+                Prediction.objects.filter(cleaned__in=list(cleaned.values()), model_name=model_name)
+                .order_by('created_at')
+                .values_list('cleaned_id', 'sentiment')
+            )
+        cleaned_text = {digest: row.cleaned_text for digest, row in cleaned.items()}
+        sentiment = {
+            digest: predicted[row.id] for digest, row in cleaned.items() if row.id in predicted
+        }
+
+        # Normalize and classify only what is missing, as batches
+        metrics.BATCH_SIZE.observe(len(texts), stage='predict_batch')
+        normalize = get_normalizer().normalize
+        to_clean = [digest for digest in unique if digest not in cleaned_text]
+        with timer('predict_batch.clean'):
+            for digest in to_clean:
+                cleaned_text[digest] = normalize(unique[digest])
+        to_predict = [digest for digest in unique if digest not in sentiment]
+        if to_predict:
+            with timer('predict_batch.inference'):
+                results = scheduler([cleaned_text[digest] for digest in to_predict])
+            for digest, result in zip(to_predict, results):
+                sentiment[digest] = result['label']
+
+        with timer('predict_batch.db_write'), transaction.atomic():
+            missing = [digest for digest in unique if digest not in scraped]
+            if missing:
+                ScrapedData.objects.bulk_create([
+                    ScrapedData(source_url='manual', review_title='Manual Input',
+                                raw_text=unique[digest], content_hash=digest)
+                    for digest in missing
+                ], ignore_conflicts=True)
+                # Conflicting inserts don't return ids; read them all back
+                scraped.update(
+                    (row.content_hash, row)
+                    for row in ScrapedData.objects.filter(source_url='manual', content_hash__in=missing)
+                )
+
+            if to_clean:
+                CleanedData.objects.bulk_create([
+                    CleanedData(scraped=scraped[digest], cleaned_text=cleaned_text[digest],
+                                cleaning_version=settings.CLEANING_VERSION)
+                    for digest in to_clean
+                ], ignore_conflicts=True)
+
+            if to_predict:
+                # Read back (and lock, in id order so concurrent batches can't
+                # deadlock) the reviews being predicted, including rows a
+                # concurrent request inserted first, then skip any it has
+                # already predicted
+                by_scraped = {scraped[digest].id: digest for digest in to_predict}
+                cleaned.update(
+                    (by_scraped[row.scraped_id], row)
+                    for row in CleanedData.objects.select_for_update().filter(
+                        scraped_id__in=list(by_scraped), cleaning_version=settings.CLEANING_VERSION
+                    ).order_by('id')
+                )
+                done = set(
+                    Prediction.objects.filter(
+                        cleaned__in=[cleaned[digest] for digest in to_predict], model_name=model_name)
+                    .values_list('cleaned_id', flat=True)
+                )
+                Prediction.objects.bulk_create([
+                    Prediction(cleaned=cleaned[digest], sentiment=sentiment[digest],
+                               model_name=model_name)
+                    for digest in to_predict if cleaned[digest].id not in done
+                ])
+
+        return Response({
+            "results": [
+                {"cleaned_text": cleaned_text[digest], "sentiment": sentiment[digest]}
+                for digest in hashes
+            ]
+        })
+
+
+class MetricsView(View):
+    """Prometheus scrape target for this worker process"""
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class MlModelConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ml_model'
+
+    def ready(self):
+        # Web workers opt in (see wsgi.py / asgi.py) so that management
+        # commands such as migrate don't pay for loading the models.
+        if settings.SENTIMENT_WARMUP:
+            from .registry import warm_up
+            warm_up()
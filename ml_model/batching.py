@@ -0,0 +1,168 @@
+"""
+Dynamic micro-batching for single-text inference requests.
+
+Request threads hand their text to a ``MicroBatcher`` and wait on a future.
+One scheduler thread per model collects whatever arrives within
+``INFERENCE_BATCH_WAIT_MS`` of the first queued text (up to
+``INFERENCE_MAX_BATCH_SIZE``), runs them through the model as one padded
+batch (bucketed by token length, see ml_model.scheduling) and hands each
+caller its own result.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from smart_text_pipeline.metrics import BATCH_SIZE, STAGE_SECONDS, register_collector
+
+from .scheduling import get_scheduler
+
+
+class MicroBatcher:
+    """Groups concurrent predict() calls into batched model calls"""
+
+    def __init__(self, scheduler, max_batch_size, max_wait):
+        self.scheduler = scheduler
+        self.model = scheduler.model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._batch_sizes = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._queue_depth_max = 0
+        self._thread = threading.Thread(
+            target=self._run, name=f'microbatcher-{self.model.name}', daemon=True)
+        self._thread.start()
+
+    def predict(self, text, timeout=None):
+        """Classify one text; blocks until its batch has run"""
+        # Known texts skip the batching window altogether
+        result = self.scheduler.cached(text)
+        if result is not None:
+            return result
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._queue_depth_max = max(self._queue_depth_max, depth)
+        return future.result(timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        # The window starts when the first request arrived, not when we woke up
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed: still take anything already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            texts = [text for text, _, _ in batch]
+            # The scheduler reads and writes the prediction cache table, and
+            # this thread never sees request_finished: recycle its connection
+            # per batch so a dropped or expired one doesn't fail every batch
+            close_old_connections()
+            try:
+                results = self.scheduler(texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                close_old_connections()
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+            waits = [started - queued for _, _, queued in batch]
+            BATCH_SIZE.observe(len(batch), stage='microbatch')
+            STAGE_SECONDS.observe(time.monotonic() - started, stage='microbatch.forward')
+            for wait in waits:
+                STAGE_SECONDS.observe(wait, stage='microbatch.wait')
+            with self._stats_lock:
+                self._requests += len(batch)
+                self._batches += 1
+                self._batch_sizes[len(batch)] += 1
+                self._wait_total += sum(waits)
+                self._wait_max = max(self._wait_max, *waits)
+
+    def stats(self):
+        """Queue depth, batch size and queueing delay since startup"""
+        with self._stats_lock:
+            return {
+                'model_name': self.model.name,
+                'requests': self._requests,
+                'batches': self._batches,
+                'mean_batch_size': self._requests / self._batches if self._batches else 0.0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._queue_depth_max,
+                'mean_wait_ms': 1000 * self._wait_total / self._requests if self._requests else 0.0,
+                'max_wait_ms': 1000 * self._wait_max,
+            }
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(name=None):
+    """Return the micro-batcher for a model, starting it on first use"""
+    name = name or settings.SENTIMENT_DEFAULT_MODEL
+    batcher = _batchers.get(name)
+    if batcher is not None:
+        return batcher
+
+    scheduler = get_scheduler(name)
+    with _batchers_lock:
+        batcher = _batchers.get(name)
+        if batcher is None:
+            batcher = MicroBatcher(
+                scheduler,
+                max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+                max_wait=settings.INFERENCE_BATCH_WAIT_MS / 1000,
+            )
+            _batchers[name] = batcher
+    return batcher
+
+
+def all_stats():
+    return [batcher.stats() for batcher in list(_batchers.values())]
+
+
+def collect_metrics():
+    samples = []
+    for stats in all_stats():
+        labels = {'model': stats['model_name']}
+        samples += [
+            ('stp_microbatch_queue_depth', 'gauge', 'Texts waiting for a batch', labels,
+             stats['queue_depth']),
+            ('stp_microbatch_max_queue_depth', 'gauge', 'Deepest queue seen', labels,
+             stats['max_queue_depth']),
+            ('stp_microbatch_requests_total', 'counter', 'Texts classified by the micro-batcher',
+             labels, stats['requests']),
+            ('stp_microbatch_batches_total', 'counter', 'Model calls made by the micro-batcher',
+             labels, stats['batches']),
+        ]
+    return samples
+
+
+register_collector(collect_metrics)
@@ -0,0 +1,137 @@
+"""
+Two-tier cache of model outputs keyed by (text hash, model name, revision).
+
+Lookups go to a bounded in-process LRU first and then to the
+PredictionCache table, which is shared by every worker and survives
+restarts. The revision part of the key is the model's fingerprint (see
+ml_model.registry): changing the checkpoint, revision, backend or
+quantization behind a model name, or how long texts are scored, changes
+the key, so stale outputs are never reused.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from scraper.models import PredictionCache
+from smart_text_pipeline.metrics import register_collector
+
+
+# Keeps each IN (...) lookup well under SQLite's variable limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class TwoTierPredictionCache:
+    """Bounded LRU in front of the PredictionCache table"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, model_name, revision, hashes):
+        """Return ``{hash: {'label', 'score'}}`` for the hashes already scored"""
+        found = {}
+        with self._lock:
+            for digest in hashes:
+                result = self._entries.get((model_name, revision, digest))
+                if result is not None:
+                    self._entries.move_to_end((model_name, revision, digest))
+                    found[digest] = result
+        memory_hits = len(found)
+
+        remaining = [digest for digest in hashes if digest not in found]
+        for start in range(0, len(remaining), LOOKUP_CHUNK_SIZE):
+            rows = PredictionCache.objects.filter(
+                model_name=model_name,
+                model_revision=revision,
+                text_hash__in=remaining[start:start + LOOKUP_CHUNK_SIZE],
+            ).values_list('text_hash', 'sentiment', 'score')
+            for digest, sentiment, score in rows:
+                found[digest] = {'label': sentiment, 'score': score}
+
+        with self._lock:
+            for digest in remaining:
+                if digest in found:
+                    self._remember((model_name, revision, digest), found[digest])
+            self.memory_hits += memory_hits
+            self.db_hits += len(found) - memory_hits
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def set_many(self, model_name, revision, results):
+        """Store ``{hash: {'label', 'score'}}`` in both tiers"""
+        PredictionCache.objects.bulk_create([
+            PredictionCache(
+                text_hash=digest,
+                model_name=model_name,
+                model_revision=revision,
+                sentiment=result['label'],
+                score=result['score'],
+            )
+            for digest, result in results.items()
+        ], ignore_conflicts=True)
+        with self._lock:
+            for digest, result in results.items():
+                self._remember((model_name, revision, digest), result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    """Return the process-wide prediction cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TwoTierPredictionCache(settings.PREDICTION_CACHE_SIZE)
+    return _cache
+
+
+def collect_metrics():
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    name = 'stp_prediction_cache_lookups_total'
+    help_text = 'Prediction cache lookups by the tier that answered'
+    return [
+        (name, 'counter', help_text, {'result': 'memory_hit'}, stats['memory_hits']),
+        (name, 'counter', help_text, {'result': 'db_hit'}, stats['db_hits']),
+        (name, 'counter', help_text, {'result': 'miss'}, stats['misses']),
+        ('stp_prediction_cache_entries', 'gauge', 'Outputs held in the in-process LRU', {}, stats['size']),
+    ]
+
+
+register_collector(collect_metrics)
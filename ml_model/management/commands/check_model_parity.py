@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ml_model.registry import get_model
+from ml_model.scheduling import LengthBucketScheduler
+from scraper.models import CleanedData
+
+
+class Command(BaseCommand):
+    help = 'Compares the labels and speed of two sentiment models on stored cleaned reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--candidate', required=True,
+            help='Model name from SENTIMENT_MODELS to check, e.g. an ONNX entry')
+        parser.add_argument(
+            '--reference', default=settings.SENTIMENT_DEFAULT_MODEL,
+            help='Model name the candidate must agree with')
+        parser.add_argument(
+            '--limit', type=int, default=1000,
+            help='Number of most recent cleaned reviews to classify')
+        parser.add_argument(
+            '--batch-size', type=int, default=32,
+            help='Reviews per model call')
+        parser.add_argument(
+            '--min-agreement', type=float, default=0.99,
+            help='Fail if fewer than this fraction of labels match')
+
+    def handle(self, *args, **kwargs):
+        texts = list(
+            CleanedData.objects.order_by('-id').values_list('cleaned_text', flat=True)[:kwargs['limit']])
+        if not texts:
+            raise CommandError('No cleaned reviews to compare on; run clean_data first')
+
+        outputs = {}
+        seconds = {}
+        for name in (kwargs['reference'], kwargs['candidate']):
+            try:
+                classifier = get_model(name)
+            except LookupError as e:
+                raise CommandError(str(e))
+            # Scored the way predict_sentiment and the API score them (token
+            # truncation or sliding windows, length buckets), minus the cache
+            scheduler = LengthBucketScheduler(
+                classifier, batch_size=kwargs['batch_size'], use_cache=False)
+            scheduler(['warm up'])
+            started = time.perf_counter()
+            outputs[name] = scheduler(texts)
+            seconds[name] = time.perf_counter() - started
+            self.stdout.write(f'{name}: {len(texts) / seconds[name]:.1f} reviews/s ({seconds[name]:.2f}s)')
+
+        reference = outputs[kwargs['reference']]
+        candidate = outputs[kwargs['candidate']]
+        agree = [r['label'] == c['label'] for r, c in zip(reference, candidate)]
+        agreement = sum(agree) / len(texts)
+        score_diffs = [
+            abs(r['score'] - c['score'])
+            for r, c, same in zip(reference, candidate, agree) if same
+        ]
+
+        self.stdout.write(f"Speedup: {seconds[kwargs['reference']] / seconds[kwargs['candidate']]:.2f}x")
+        self.stdout.write(
+            f'Label agreement: {agreement:.2%} ({len(texts) - sum(agree)} of {len(texts)} differ), '
+            f'max score difference {max(score_diffs, default=0.0):.4f}')
+        if agreement < kwargs['min_agreement']:
+            raise CommandError(
+                f"Agreement {agreement:.2%} is below --min-agreement {kwargs['min_agreement']:.2%}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{kwargs['candidate']} matches {kwargs['reference']} on {agreement:.2%} of reviews."))
@@ -1,32 +1,102 @@
-from django.core.management.base import BaseCommand
+import argparse
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from scraper.models import CleanedData, Prediction
-from transformers import pipeline
+from ml_model.registry import get_model
+from ml_model.scheduling import LengthBucketScheduler
+from smart_text_pipeline import metrics
+from smart_text_pipeline.metrics import timer
 
 
 class Command(BaseCommand):
-    help = 'Predicts sentiment for cleaned text using BERT and saves to Prediction'
+    help = 'Predicts sentiment for cleaned text with a model from SENTIMENT_MODELS and saves to Prediction'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=32,
+            help='Reviews per model call')
+        parser.add_argument(
+            '--read-size', type=int, default=1024,
+            help='Rows read from the database, length-bucketed and saved together')
+        parser.add_argument(
+            '--sliding-window', action=argparse.BooleanOptionalAction, default=None,
+            help='Score long reviews as overlapping windows instead of truncating '
+                 '(default: SENTIMENT_SLIDING_WINDOW)')
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Run the model on every review instead of reusing cached outputs')
+        parser.add_argument(
+            '--model', default=settings.SENTIMENT_DEFAULT_MODEL,
+            help='Model name from SENTIMENT_MODELS (stored in Prediction.model_name)')
+        parser.add_argument(
+            '--metrics-file', metavar='FILE',
+            help='Write Prometheus metrics for this run to FILE (node_exporter textfile format)')
 
     def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        read_size = kwargs['read_size']
+        model_name = kwargs['model']
+        if batch_size < 1 or read_size < 1:
+            raise CommandError('--batch-size and --read-size must be at least 1')
+
         # Load sentiment analysis pipeline (Hugging Face)
-        classifier = pipeline('sentiment-analysis')
+        try:
+            classifier = get_model(model_name)
+        except LookupError as e:
+            raise CommandError(str(e))
+        scheduler = LengthBucketScheduler(
+            classifier, batch_size=batch_size, sliding_window=kwargs['sliding_window'],
+            use_cache=not kwargs['no_cache'])
 
         count = 0
+        last_id = 0
 
-        cleaned_reviews = CleanedData.objects.all()
-
-        for cleaned in cleaned_reviews:
-            text = cleaned.cleaned_text
+        already_scored = Prediction.objects.filter(
+            cleaned=OuterRef('pk'), model_name=model_name)
 
-            # BERT has a token limit; keep it safe
-            result = classifier(text[:512])
+        # Walk the current cleanings by primary key so only one batch is held
+        # in memory, skipping reviews that already have a prediction from this
+        # model. No id checkpoint is kept between runs: rows can commit out of
+        # id order, and the anti-join alone lets a killed run resume.
+        while True:
+            started = time.perf_counter()
+            with timer('predict_sentiment.db_read'):
+                batch = list(
+                    CleanedData.objects.filter(
+                        id__gt=last_id, cleaning_version=settings.CLEANING_VERSION)
+                    .filter(~Exists(already_scored))
+                    .order_by('id')
+                    .only('id', 'cleaned_text')[:read_size]
+                )
+            if not batch:
+                break
+            last_id = batch[-1].id
 
-            sentiment_label = result[0]['label']
+            # Truncated by token count and padded per length bucket
+            with timer('predict_sentiment.inference'):
+                results = scheduler([cleaned.cleaned_text for cleaned in batch])
 
-            Prediction.objects.create(
-                cleaned=cleaned,
-                sentiment=sentiment_label
-            )
-            count += 1
+            with timer('predict_sentiment.db_write'), transaction.atomic():
+                Prediction.objects.bulk_create([
+                    Prediction(
+                        cleaned=cleaned,
+                        sentiment=result['label'],
+                        model_name=model_name
+                    )
+                    for cleaned, result in zip(batch, results)
+                ])
+            count += len(batch)
+            metrics.record_batch('predict_sentiment', len(batch), time.perf_counter() - started)
 
+        self.stdout.write(scheduler.stats.summary())
+        if scheduler.cache is not None:
+            self.stdout.write(
+                f"Prediction cache hit rate: {scheduler.cache.stats()['hit_rate']:.1%}")
+        if kwargs['metrics_file']:
+            metrics.write_textfile(kwargs['metrics_file'])
         self.stdout.write(self.style.SUCCESS(
-            f'Successfully predicted sentiment for {count} reviews using BERT.'))
+            f'Successfully predicted sentiment for {count} reviews using {model_name}.'))
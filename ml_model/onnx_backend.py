@@ -0,0 +1,112 @@
+"""
+ONNX Runtime backend for sentiment models.
+
+A ``SENTIMENT_MODELS`` entry with ``'backend': 'onnx'`` is exported from its
+Hugging Face checkpoint to ONNX with optimum, optionally quantized to int8
+with dynamic quantization, and served by ONNX Runtime on the CPU. The export
+is written once under ``SENTIMENT_ONNX_DIR/<model_name>/<fingerprint>`` and
+reused by every worker after that; a file lock next to it makes sure only one
+worker builds it.
+"""
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+from .registry import fingerprint
+
+
+QUANTIZED_FILE = 'model_quantized.onnx'
+EXPORTED_FILE = 'model.onnx'
+
+
+def model_dir(name, config):
+    # Keyed like the prediction cache, so changing the checkpoint or the
+    # quantization under the same name exports again
+    return Path(settings.SENTIMENT_ONNX_DIR) / name / fingerprint(config)
+
+
+def export_lock(target):
+    from filelock import FileLock
+
+    return FileLock(str(target) + '.lock')
+
+
+def onnx_file(config):
+    return QUANTIZED_FILE if config.get('quantization') else EXPORTED_FILE
+
+
+def export(name, config, force=False):
+    """Export (and quantize) the checkpoint for ``name`` unless already done"""
+    target = model_dir(name, config)
+    if (target / onnx_file(config)).exists() and not force:
+        return target
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with export_lock(target):
+        # Another worker may have finished the export while this one waited
+        if (target / onnx_file(config)).exists() and not force:
+            return target
+        build(name, config, target)
+    return target
+
+
+def build(name, config, target):
+    """Write a fresh export of ``name`` to ``target``; callers hold its lock"""
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    # Build in a scratch directory and move it into place, so a worker never
+    # loads a half-written export
+    build_dir = Path(tempfile.mkdtemp(prefix=f'{name}-', dir=target.parent))
+    try:
+        revision = config.get('revision')
+        model = ORTModelForSequenceClassification.from_pretrained(
+            config['model'], revision=revision, export=True)
+        model.save_pretrained(build_dir)
+        AutoTokenizer.from_pretrained(config['model'], revision=revision).save_pretrained(build_dir)
+
+        scheme = config.get('quantization')
+        if scheme:
+            # Dynamic quantization: int8 weights, activations scaled at runtime
+            qconfig = getattr(AutoQuantizationConfig, scheme)(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(build_dir).quantize(
+                save_dir=build_dir, quantization_config=qconfig)
+
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(build_dir, target)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def session_options():
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if settings.SENTIMENT_NUM_THREADS:
+        options.intra_op_num_threads = settings.SENTIMENT_NUM_THREADS
+    if settings.SENTIMENT_INTEROP_THREADS:
+        options.inter_op_num_threads = settings.SENTIMENT_INTEROP_THREADS
+    return options
+
+
+def load_pipeline(name, config):
+    """Return a transformers pipeline running the exported model on ONNX Runtime"""
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import AutoTokenizer, pipeline
+
+    path = export(name, config)
+    # Held while reading, so a forced re-export cannot swap the files mid-load
+    with export_lock(path):
+        model = ORTModelForSequenceClassification.from_pretrained(
+            path,
+            file_name=onnx_file(config),
+            provider='CPUExecutionProvider',
+            session_options=session_options(),
+        )
+        tokenizer = AutoTokenizer.from_pretrained(path)
+    return pipeline(config.get('task', 'sentiment-analysis'), model=model, tokenizer=tokenizer)
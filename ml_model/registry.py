@@ -0,0 +1,156 @@
+"""
+Process-wide registry of sentiment classifiers.
+
+Every model listed in ``settings.SENTIMENT_MODELS`` is loaded at most once per
+worker process and shared by all request threads. Models are keyed by the
+value stored in ``Prediction.model_name``; an entry's ``backend`` selects
+PyTorch (the default), ONNX Runtime (see ml_model.onnx_backend) or, for
+benchmarks, a lexicon stub (see ml_model.stub_backend).
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+
+
+_models = {}
+_registry_lock = threading.Lock()
+_threads_configured = False
+
+
+def fingerprint(config, commit_hash=None):
+    """Short id of the checkpoint and runtime behind a SENTIMENT_MODELS entry"""
+    parts = (
+        config.get('model') or '',
+        config.get('backend', 'torch'),
+        config.get('quantization') or '',
+        config.get('revision') or '',
+        commit_hash or '',
+    )
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class SentimentModel:
+    """A loaded Hugging Face pipeline that can be shared between threads"""
+
+    def __init__(self, name, classifier):
+        self.name = name
+        self.classifier = classifier
+        # Fast tokenizers are not re-entrant, so calls are serialised per model.
+        # Torch still parallelises each forward pass over SENTIMENT_NUM_THREADS.
+        self._lock = threading.Lock()
+
+    def __call__(self, texts, **kwargs):
+        with self._lock:
+            return self.classifier(texts, **kwargs)
+
+    @property
+    def tokenizer(self):
+        return self.classifier.tokenizer
+
+    @property
+    def fingerprint(self):
+        """Changes whenever the weights or runtime behind this name change"""
+        # The commit actually resolved, so an unpinned checkpoint that moved
+        # on the Hub gets a new fingerprint too
+        commit_hash = getattr(self.classifier.model.config, '_commit_hash', None)
+        return fingerprint(settings.SENTIMENT_MODELS.get(self.name, {}), commit_hash)
+
+    @property
+    def labels(self):
+        config = self.classifier.model.config
+        return [config.id2label[i] for i in range(config.num_labels)]
+
+    def max_tokens(self):
+        """Content tokens that fit in one sequence next to the special tokens"""
+        limit = min(
+            self.tokenizer.model_max_length,
+            getattr(self.classifier.model.config, 'max_position_embeddings', 512),
+        )
+        return limit - self.tokenizer.num_special_tokens_to_add()
+
+    def encode(self, texts):
+        """Token ids of each text, untruncated and without special tokens"""
+        with self._lock:
+            return self.tokenizer(list(texts), add_special_tokens=False, verbose=False)['input_ids']
+
+    def probabilities(self, sequences):
+        """Run one padded batch of token id lists; returns label probabilities"""
+        import torch
+
+        with self._lock:
+            batch = self.tokenizer.pad(
+                {'input_ids': [self.tokenizer.build_inputs_with_special_tokens(ids) for ids in sequences]},
+                return_tensors='pt',
+            )
+            with torch.inference_mode():
+                logits = self.classifier.model(**batch).logits
+            return logits.softmax(-1).tolist()
+
+
+def configure_threads():
+    """Apply the CPU thread settings to torch once per process"""
+    global _threads_configured
+    if _threads_configured:
+        return
+
+    import torch
+
+    if settings.SENTIMENT_NUM_THREADS:
+        torch.set_num_threads(settings.SENTIMENT_NUM_THREADS)
+    if settings.SENTIMENT_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(settings.SENTIMENT_INTEROP_THREADS)
+        except RuntimeError:
+            # Can only be set before torch starts any inter-op work.
+            pass
+    _threads_configured = True
+
+
+def _load(name):
+    config = settings.SENTIMENT_MODELS[name]
+    if config.get('backend', 'torch') == 'onnx':
+        from .onnx_backend import load_pipeline
+
+        return SentimentModel(name, load_pipeline(name, config))
+    if config.get('backend') == 'stub':
+        from .stub_backend import StubModel
+
+        return StubModel(name, config)
+
+    from transformers import pipeline
+
+    configure_threads()
+    classifier = pipeline(
+        config.get('task', 'sentiment-analysis'),
+        model=config.get('model'),
+        revision=config.get('revision'),
+        device=-1,
+    )
+    return SentimentModel(name, classifier)
+
+
+def get_model(name=None):
+    """Return the shared classifier for ``name``, loading it on first use"""
+    name = name or settings.SENTIMENT_DEFAULT_MODEL
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    if name not in settings.SENTIMENT_MODELS:
+        raise LookupError(f'Unknown sentiment model: {name}')
+
+    with _registry_lock:
+        model = _models.get(name)
+        if model is None:
+            model = _load(name)
+            _models[name] = model
+    return model
+
+
+def warm_up(names=None):
+    """Load the given (default: the default) models and run one dummy pass"""
+    # Other models load on first use, so a worker only holds what it serves
+    for name in names or [settings.SENTIMENT_DEFAULT_MODEL]:
+        model = get_model(name)
+        model('warm up')
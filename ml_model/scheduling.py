@@ -0,0 +1,209 @@
+"""
+Token-aware batch scheduling for sentiment models.
+
+Texts are tokenized up front and truncated by token count instead of by
+characters. The resulting sequences are sorted by length and cut into
+batches, so each padded batch holds texts of similar length and little of
+every forward pass is spent on padding. Reviews longer than the model
+limit can be split into overlapping windows whose label probabilities are
+averaged, weighted by window length. Texts scored before are answered from
+the prediction cache (ml_model.cache) without running the model.
+"""
+import threading
+
+from django.conf import settings
+
+from smart_text_pipeline.metrics import register_collector
+
+from .cache import get_prediction_cache, text_hash
+from .registry import get_model
+
+
+class PaddingStats:
+    """Real vs padded tokens fed to the model"""
+
+    def __init__(self):
+        self.texts = 0
+        self.sequences = 0
+        self.batches = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        # Padded tokens the same batches would have cost in arrival order
+        self.unsorted_padded_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, texts, sequences, batches, real, padded, unsorted_padded):
+        with self._lock:
+            self.texts += texts
+            self.sequences += sequences
+            self.batches += batches
+            self.real_tokens += real
+            self.padded_tokens += padded
+            self.unsorted_padded_tokens += unsorted_padded
+
+    def waste(self):
+        """Fraction of the padded batches that was padding"""
+        return 1 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+    def unsorted_waste(self):
+        if not self.unsorted_padded_tokens:
+            return 0.0
+        return 1 - self.real_tokens / self.unsorted_padded_tokens
+
+    def summary(self):
+        return (
+            f'{self.texts} texts as {self.sequences} sequences in {self.batches} batches, '
+            f'padding {self.waste():.1%} of tokens (arrival order: {self.unsorted_waste():.1%})'
+        )
+
+
+def _padded(lengths, batch_size):
+    return sum(
+        len(lengths[start:start + batch_size]) * max(lengths[start:start + batch_size])
+        for start in range(0, len(lengths), batch_size)
+    )
+
+
+class LengthBucketScheduler:
+    """Classifies texts in batches of similar token length"""
+
+    def __init__(self, model, batch_size=32, sliding_window=None, window_overlap=None,
+                 use_cache=True):
+        self.model = model
+        self.batch_size = batch_size
+        self.sliding_window = (
+            settings.SENTIMENT_SLIDING_WINDOW if sliding_window is None else sliding_window)
+        self.window_overlap = (
+            settings.SENTIMENT_WINDOW_OVERLAP if window_overlap is None else window_overlap)
+        self.cache = get_prediction_cache() if use_cache else None
+        # Cached outputs are only valid for the same weights and windowing
+        self.revision = model.fingerprint
+        if self.sliding_window:
+            self.revision += f'+window{self.window_overlap}'
+        self.stats = PaddingStats()
+        self._max_tokens = None
+
+    def windows(self, ids):
+        """Split (or truncate) one text's token ids to the model limit"""
+        if self._max_tokens is None:
+            self._max_tokens = self.model.max_tokens()
+        size = self._max_tokens
+        if len(ids) <= size or not self.sliding_window:
+            return [ids[:size]]
+        step = max(1, size - self.window_overlap)
+        windows = []
+        start = 0
+        while True:
+            windows.append(ids[start:start + size])
+            if start + size >= len(ids):
+                return windows
+            start += step
+
+    def cached(self, text):
+        """The cached result for one text, or None"""
+        if self.cache is None:
+            return None
+        digest = text_hash(text)
+        return self.cache.get_many(self.model.name, self.revision, [digest]).get(digest)
+
+    def __call__(self, texts):
+        """Return one ``{'label', 'score'}`` dict per text, in input order"""
+        if not texts:
+            return []
+        hashes = [text_hash(text) for text in texts]
+        known = {}
+        if self.cache is not None:
+            known = self.cache.get_many(self.model.name, self.revision, list(dict.fromkeys(hashes)))
+
+        # Each distinct unseen text goes through the model once
+        missing = {}
+        for digest, text in zip(hashes, texts):
+            if digest not in known:
+                missing.setdefault(digest, text)
+        if missing:
+            fresh = dict(zip(missing, self.classify(list(missing.values()))))
+            if self.cache is not None:
+                self.cache.set_many(self.model.name, self.revision, fresh)
+            known.update(fresh)
+        return [known[digest] for digest in hashes]
+
+    def classify(self, texts):
+        """Run the model on every text, bypassing the cache"""
+        sequences = []
+        owners = []
+        for i, ids in enumerate(self.model.encode(texts)):
+            for window in self.windows(ids):
+                sequences.append(window)
+                owners.append(i)
+
+        special = self.model.tokenizer.num_special_tokens_to_add()
+        lengths = [len(sequence) + special for sequence in sequences]
+        order = sorted(range(len(sequences)), key=lengths.__getitem__)
+
+        probabilities = [None] * len(sequences)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for j, probs in zip(batch, self.model.probabilities([sequences[j] for j in batch])):
+                probabilities[j] = probs
+
+        self.stats.record(
+            texts=len(texts),
+            sequences=len(sequences),
+            batches=-(-len(sequences) // self.batch_size),
+            real=sum(lengths),
+            padded=_padded([lengths[j] for j in order], self.batch_size),
+            unsorted_padded=_padded(lengths, self.batch_size),
+        )
+
+        # Average each text's windows, weighted by their token count
+        totals = [None] * len(texts)
+        weights = [0] * len(texts)
+        for owner, sequence, probs in zip(owners, sequences, probabilities):
+            weight = max(1, len(sequence))
+            if totals[owner] is None:
+                totals[owner] = [0.0] * len(probs)
+            totals[owner] = [t + weight * p for t, p in zip(totals[owner], probs)]
+            weights[owner] += weight
+
+        labels = self.model.labels
+        results = []
+        for total, weight in zip(totals, weights):
+            scores = [t / weight for t in total]
+            best = max(range(len(scores)), key=scores.__getitem__)
+            results.append({'label': labels[best], 'score': scores[best]})
+        return results
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name=None):
+    """Return the shared scheduler used by the API for a model"""
+    name = name or settings.SENTIMENT_DEFAULT_MODEL
+    scheduler = _schedulers.get(name)
+    if scheduler is not None:
+        return scheduler
+
+    model = get_model(name)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(name)
+        if scheduler is None:
+            scheduler = LengthBucketScheduler(model, batch_size=settings.INFERENCE_MAX_BATCH_SIZE)
+            _schedulers[name] = scheduler
+    return scheduler
+
+
+def collect_metrics():
+    name = 'stp_inference_tokens_total'
+    help_text = 'Tokens fed to the model: real, padded, and padded in arrival order'
+    samples = []
+    for model_name, scheduler in list(_schedulers.items()):
+        stats = scheduler.stats
+        for kind, value in (('real', stats.real_tokens), ('padded', stats.padded_tokens),
+                            ('unsorted_padded', stats.unsorted_padded_tokens)):
+            samples.append((name, 'counter', help_text, {'model': model_name, 'kind': kind}, value))
+    return samples
+
+
+register_collector(collect_metrics)
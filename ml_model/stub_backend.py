@@ -0,0 +1,83 @@
+"""
+Lexicon-based stand-in for a sentiment model, used by benchmarks.
+
+A ``SENTIMENT_MODELS`` entry with ``'backend': 'stub'`` loads ``StubModel``
+instead of a Hugging Face checkpoint. It offers the same interface the
+scheduler and micro-batcher use (``encode``, ``probabilities``, ``labels``...)
+with whitespace tokens and a short word list, so the database, cleaning and
+batching stages can be measured without torch or a model download. An
+optional ``latency_ms`` adds a fixed cost to every model call.
+"""
+import threading
+import time
+
+from .registry import fingerprint
+
+
+POSITIVE_WORDS = (
+    'good', 'great', 'excellent', 'brilliant', 'love', 'enjoy', 'masterpiece',
+    'fun', 'beautiful', 'perfect', 'wonderful', 'superb',
+)
+NEGATIVE_WORDS = (
+    'bad', 'awful', 'boring', 'terrible', 'waste', 'hate', 'dull', 'worst',
+    'poor', 'mess', 'disappointing', 'predictable',
+)
+
+OTHER, POSITIVE, NEGATIVE = 1, 2, 3
+TOKEN_IDS = {
+    **{word: POSITIVE for word in POSITIVE_WORDS},
+    **{word: NEGATIVE for word in NEGATIVE_WORDS},
+}
+
+
+class StubTokenizer:
+    """Whitespace tokenizer mapping each word to a sentiment class id"""
+
+    def __call__(self, texts):
+        return [[TOKEN_IDS.get(word, OTHER) for word in text.split()] for text in texts]
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+
+class StubModel:
+    """Scores a text by its share of positive and negative words"""
+
+    labels = ['NEGATIVE', 'POSITIVE']
+
+    def __init__(self, name, config):
+        self.name = name
+        self.fingerprint = fingerprint(config)
+        self.tokenizer = StubTokenizer()
+        self.latency = config.get('latency_ms', 0) / 1000
+        self._max_tokens = config.get('max_tokens', 510)
+        # Calls are serialised like SentimentModel's, so the latency behaves
+        # like a forward pass that occupies the model
+        self._lock = threading.Lock()
+
+    def __call__(self, texts, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        results = []
+        for probs in self.probabilities(self.encode(texts)):
+            best = max(range(len(probs)), key=probs.__getitem__)
+            results.append({'label': self.labels[best], 'score': probs[best]})
+        return results
+
+    def max_tokens(self):
+        return self._max_tokens
+
+    def encode(self, texts):
+        return self.tokenizer(list(texts))
+
+    def probabilities(self, sequences):
+        with self._lock:
+            if self.latency:
+                time.sleep(self.latency)
+            results = []
+            for ids in sequences:
+                positive = ids.count(POSITIVE)
+                negative = ids.count(NEGATIVE)
+                p = (positive + 1) / (positive + negative + 2)
+                results.append([1 - p, p])
+            return results
@@ -1,3 +1,162 @@
-from django.test import TestCase
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from scraper.models import CleanedData, Prediction, ScrapedData
+
+from .batching import MicroBatcher
+from .cache import get_prediction_cache
+from .scheduling import LengthBucketScheduler
+from .stub_backend import StubModel
+
+
+class PredictionCacheKeyTests(TestCase):
+    def scheduler(self, config):
+        with override_settings(SENTIMENT_MODELS={'sentiment': config}):
+            return LengthBucketScheduler(StubModel('sentiment', config))
+
+    def setUp(self):
+        get_prediction_cache().clear()
+
+    def test_outputs_are_reused_for_the_same_checkpoint(self):
+        config = {'backend': 'stub', 'model': 'org/checkpoint-a'}
+        self.scheduler(config)(['a great film'])
+        get_prediction_cache().clear()
+
+        scheduler = self.scheduler(config)
+        self.assertIsNotNone(scheduler.cached('a great film'))
+
+    def test_changing_the_checkpoint_under_the_same_name_misses(self):
+        self.scheduler({'backend': 'stub', 'model': 'org/checkpoint-a'})(['a great film'])
+        get_prediction_cache().clear()
+
+        for changed in ({'model': 'org/checkpoint-b'}, {'quantization': 'avx2'}):
+            scheduler = self.scheduler({'backend': 'stub', 'model': 'org/checkpoint-a', **changed})
+            self.assertIsNone(scheduler.cached('a great film'))
+
+
+@override_settings(
+    SENTIMENT_MODELS={'stub': {'backend': 'stub', 'model': 'org/stub'}}, CLEANING_VERSION=2)
+class PredictSentimentCommandTests(TestCase):
+    def predict(self):
+        out = StringIO()
+        call_command('predict_sentiment', model='stub', no_cache=True, stdout=out)
+        return out.getvalue()
+
+    def cleaned(self, text, version=2, **kwargs):
+        scraped = ScrapedData.objects.create(source_url='https://www.imdb.com/review', raw_text=text)
+        return CleanedData.objects.create(
+            scraped=scraped, cleaned_text=text, cleaning_version=version, **kwargs)
+
+    def test_rows_committed_out_of_id_order_are_predicted(self):
+        self.cleaned('an awful film', pk=10)
+        self.predict()
+        # Committed after the first run, with a lower id
+        late = self.cleaned('a great film', pk=5)
+
+        self.assertIn('for 1 reviews using stub', self.predict())
+        self.assertEqual(Prediction.objects.get(cleaned=late).sentiment, 'POSITIVE')
+
+    def test_only_the_current_cleaning_version_is_predicted(self):
+        stale = self.cleaned('a great film', version=1)
+        current = CleanedData.objects.create(
+            scraped=stale.scraped, cleaned_text='great film', cleaning_version=2)
+
+        self.predict()
+        self.assertQuerySetEqual(
+            Prediction.objects.values_list('cleaned', flat=True), [current.pk])
+
+
+@override_settings(
+    SENTIMENT_MODELS={
+        'full': {'backend': 'stub', 'model': 'org/stub'},
+        'short': {'backend': 'stub', 'model': 'org/stub', 'max_tokens': 2},
+    },
+    SENTIMENT_SLIDING_WINDOW=False)
+class CheckModelParityTests(TestCase):
+    def test_reviews_are_truncated_by_tokens_as_when_served(self):
+        scraped = ScrapedData.objects.create(
+            source_url='https://www.imdb.com/review', raw_text='a long review')
+        CleanedData.objects.create(scraped=scraped, cleaned_text='the plot was great great great')
+
+        # 'short' only sees 'the plot' after truncation to its token limit
+        with self.assertRaisesMessage(CommandError, 'below --min-agreement'):
+            call_command(
+                'check_model_parity', candidate='short', reference='full', stdout=StringIO())
+
+
+class RecordingScheduler:
+    """Labels each text with itself, recording every batch it is called with"""
+
+    def __init__(self, error=None):
+        self.model = SimpleNamespace(name='recording')
+        self.error = error
+        self.calls = []
+        # Cleared to hold batches in the "model" until the test sets it
+        self.running = threading.Event()
+        self.running.set()
+
+    def cached(self, text):
+        return None
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        self.running.wait()
+        if self.error is not None:
+            raise self.error
+        return [{'label': text.upper(), 'score': 1.0} for text in texts]
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def predict_all(self, batcher, texts, timeout=5):
+        with ThreadPoolExecutor(len(texts)) as pool:
+            futures = [pool.submit(batcher.predict, text, timeout) for text in texts]
+            return [future.result() for future in futures]
+
+    def test_concurrent_requests_share_one_model_call(self):
+        scheduler = RecordingScheduler()
+        batcher = MicroBatcher(scheduler, max_batch_size=32, max_wait=0.5)
+        texts = [f'review {i}' for i in range(8)]
+
+        results = self.predict_all(batcher, texts)
+        self.assertEqual([result['label'] for result in results], [text.upper() for text in texts])
+        self.assertEqual(len(scheduler.calls), 1)
+        self.assertCountEqual(scheduler.calls[0], texts)
+        self.assertEqual(batcher.stats()['batch_sizes'], {8: 1})
+
+    def test_batches_are_capped(self):
+        scheduler = RecordingScheduler()
+        batcher = MicroBatcher(scheduler, max_batch_size=3, max_wait=0.5)
+        texts = [f'review {i}' for i in range(7)]
+
+        results = self.predict_all(batcher, texts)
+        self.assertEqual([result['label'] for result in results], [text.upper() for text in texts])
+        self.assertLessEqual(max(len(call) for call in scheduler.calls), 3)
+        self.assertCountEqual(sum(scheduler.calls, []), texts)
+
+    def test_model_errors_reach_every_waiter(self):
+        scheduler = RecordingScheduler(error=RuntimeError('model failed'))
+        batcher = MicroBatcher(scheduler, max_batch_size=32, max_wait=0.2)
+
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(batcher.predict, f'review {i}', 5) for i in range(4)]
+            for future in futures:
+                with self.assertRaisesMessage(RuntimeError, 'model failed'):
+                    future.result()
+
+        # The scheduler thread survives the failed batch
+        scheduler.error = None
+        self.assertEqual(batcher.predict('again', 5)['label'], 'AGAIN')
+
+    def test_waiting_callers_time_out(self):
+        scheduler = RecordingScheduler()
+        scheduler.running.clear()
+        batcher = MicroBatcher(scheduler, max_batch_size=32, max_wait=0)
+
+        with self.assertRaises(TimeoutError):
+            batcher.predict('slow review', timeout=0.1)
+        scheduler.running.set()
+        self.assertEqual(batcher.predict('next review', 5)['label'], 'NEXT REVIEW')
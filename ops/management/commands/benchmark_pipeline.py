@@ -0,0 +1,355 @@
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from scraper.models import Prediction, ScrapedData, content_hash
+from ml_model.cache import get_prediction_cache
+from ml_model.stub_backend import NEGATIVE_WORDS, POSITIVE_WORDS
+
+
+STUB_MODEL = 'benchmark-stub'
+
+FILLER_WORDS = (
+    'film', 'movie', 'plot', 'story', 'actor', 'actress', 'scene', 'character',
+    'director', 'ending', 'music', 'camera', 'script', 'dialogue', 'cast',
+    'performance', 'sequel', 'audience', 'minute', 'hour', 'screen', 'role',
+    'twist', 'villain', 'hero', 'effect', 'budget', 'studio', 'trailer', 'book',
+)
+STOP_WORDS = (
+    'the', 'a', 'an', 'and', 'but', 'was', 'is', 'it', 'this', 'that', 'of',
+    'to', 'i', 'in', 'with', 'very', 'so', 'too', 'not', 'for',
+)
+REVIEWS_PER_TITLE = 25
+INSERT_CHUNK_SIZE = 5000
+WARMUP_REQUESTS = 3
+
+
+class SyntheticCorpus:
+    """Reproducible IMDB-like reviews; the first n reviews are the same for any size"""
+
+    def __init__(self, seed):
+        self.seed = seed
+        # Half the reviews lean positive and half negative
+        self.vocabularies = [self.vocabulary(POSITIVE_WORDS), self.vocabulary(NEGATIVE_WORDS)]
+
+    def vocabulary(self, polar):
+        """Words and cumulative weights: mostly filler and stop words, some sentiment"""
+        pools = ((FILLER_WORDS, 55), (STOP_WORDS, 30), (polar, 10), (POSITIVE_WORDS + NEGATIVE_WORDS, 5))
+        words = []
+        weights = []
+        for pool, share in pools:
+            words.extend(pool)
+            weights.extend([share / len(pool)] * len(pool))
+        return words, list(itertools.accumulate(weights))
+
+    def review(self, rng):
+        # Review lengths are long-tailed: most are short, a few run past the model limit
+        length = int(min(1000, max(5, rng.lognormvariate(math.log(120), 0.7))))
+        words, cum_weights = rng.choice(self.vocabularies)
+        words = rng.choices(words, cum_weights=cum_weights, k=length)
+        sentences = [
+            ' '.join(words[start:start + 12]).capitalize() + '.'
+            for start in range(0, len(words), 12)
+        ]
+        return ' '.join(sentences)
+
+    def texts(self, count, stream):
+        """``count`` reviews from a separate random stream, e.g. for API requests"""
+        rng = random.Random(f'{self.seed}:{stream}')
+        return [self.review(rng) for _ in range(count)]
+
+    def load(self, rows):
+        """Insert ``rows`` reviews into ScrapedData"""
+        rng = random.Random(self.seed)
+        for start in range(0, rows, INSERT_CHUNK_SIZE):
+            batch = []
+            for i in range(start, min(rows, start + INSERT_CHUNK_SIZE)):
+                text = self.review(rng)
+                batch.append(ScrapedData(
+                    source_url=f'https://bench.invalid/title/tt{i // REVIEWS_PER_TITLE:07d}/reviews',
+                    review_title=f'Synthetic review {i}',
+                    raw_text=text,
+                    content_hash=content_hash(text),
+                ))
+            # A short review can repeat within a title; the duplicate is skipped
+            ScrapedData.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def latency_summary(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(latencies) * 1000 / len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks clean_data, predict_sentiment and the prediction API on synthetic '
+        'corpora in a throwaway test database (SQLite or a local Postgres user with CREATEDB)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[1000, 10000],
+            help='Corpus sizes to benchmark, e.g. 1000 10000 100000 1000000')
+        parser.add_argument(
+            '--seed', type=int, default=42,
+            help='Seed for the synthetic corpus')
+        parser.add_argument(
+            '--model', default='stub',
+            help="Model name from SENTIMENT_MODELS, or 'stub' for the lexicon stub (no torch)")
+        parser.add_argument(
+            '--stub-latency-ms', type=float, default=0,
+            help='Fixed cost the stub adds to each model call')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='clean_data worker processes')
+        parser.add_argument(
+            '--batch-size', type=int, default=32,
+            help='predict_sentiment reviews per model call')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32],
+            help='Concurrent API clients')
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests per endpoint and concurrency level')
+        parser.add_argument(
+            '--skip', nargs='+', default=[], choices=['clean', 'predict', 'api'],
+            help='Stages to leave out')
+        parser.add_argument(
+            '--json', metavar='FILE',
+            help='Where to write the results (default: benchmarks/pipeline-<timestamp>.json)')
+        parser.add_argument(
+            '--baseline', metavar='FILE',
+            help='Earlier results to compare against')
+        parser.add_argument(
+            '--max-regression', type=float, metavar='PCT',
+            help='Fail if any throughput or p95 latency is more than PCT%% worse than --baseline')
+
+    def handle(self, *args, **kwargs):
+        rows = sorted(set(kwargs['rows']))
+        if rows[0] < 1 or kwargs['requests'] < 1 or min(kwargs['concurrency']) < 1:
+            raise CommandError('--rows, --requests and --concurrency must be at least 1')
+        if kwargs['max_regression'] is not None and not kwargs['baseline']:
+            raise CommandError('--max-regression needs --baseline')
+        baseline = None
+        if kwargs['baseline']:
+            try:
+                with open(kwargs['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot read baseline: {e}')
+
+        models = settings.SENTIMENT_MODELS
+        model_name = kwargs['model']
+        if model_name == 'stub':
+            model_name = STUB_MODEL
+            models = {**models, STUB_MODEL: {
+                'backend': 'stub', 'latency_ms': kwargs['stub_latency_ms']}}
+        elif model_name not in models:
+            raise CommandError(f'Unknown sentiment model: {model_name}')
+        self.model_name = model_name
+        self.corpus = SyntheticCorpus(kwargs['seed'])
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'database': connection.vendor,
+            },
+            'config': {
+                key: kwargs[key] for key in (
+                    'seed', 'model', 'stub_latency_ms', 'workers', 'batch_size',
+                    'concurrency', 'requests', 'skip')
+            },
+            'results': [],
+        }
+
+        with tempfile.TemporaryDirectory() as scratch, override_settings(
+                SENTIMENT_MODELS=models):
+            if connection.vendor == 'sqlite':
+                # A file rather than the in-memory default, so concurrent API
+                # clients wait on locks instead of failing on a shared cache
+                connection.settings_dict['TEST']['NAME'] = os.path.join(scratch, 'benchmark.sqlite3')
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                for size in rows:
+                    result = self.run_size(size, kwargs)
+                    report['results'].append(result)
+                    self.print_result(result)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        path = kwargs['json'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks',
+            f"pipeline-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {path}'))
+
+        if baseline is not None:
+            self.compare(baseline, report, kwargs['max_regression'])
+
+    def run_size(self, size, kwargs):
+        """Load a fresh corpus of ``size`` reviews and time every stage on it"""
+        call_command('flush', interactive=False, verbosity=0)
+        get_prediction_cache().clear()
+        result = {'rows': size}
+
+        started = time.perf_counter()
+        self.corpus.load(size)
+        result['load'] = self.throughput(ScrapedData.objects.count(), time.perf_counter() - started)
+
+        if 'clean' not in kwargs['skip']:
+            started = time.perf_counter()
+            call_command('clean_data', workers=kwargs['workers'], stdout=StringIO())
+            result['clean_data'] = self.throughput(size, time.perf_counter() - started)
+
+        if 'predict' not in kwargs['skip']:
+            started = time.perf_counter()
+            call_command(
+                'predict_sentiment', model=self.model_name, batch_size=kwargs['batch_size'],
+                no_cache=True, stdout=StringIO())
+            result['predict_sentiment'] = self.throughput(
+                Prediction.objects.count(), time.perf_counter() - started)
+
+        if 'api' not in kwargs['skip']:
+            result['api'] = []
+            for concurrency in kwargs['concurrency']:
+                result['api'].append(self.measure_api(
+                    'predictions', concurrency, kwargs['requests'],
+                    lambda client, i: client.get('/api/predictions/', {'page_size': 50})))
+                texts = self.corpus.texts(kwargs['requests'] + WARMUP_REQUESTS, f'api:{size}:{concurrency}')
+                result['api'].append(self.measure_api(
+                    'predict', concurrency, kwargs['requests'],
+                    lambda client, i: client.post(
+                        '/api/predict/', {'text': texts[i], 'model_name': self.model_name},
+                        content_type='application/json')))
+        return result
+
+    def throughput(self, rows, seconds):
+        return {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0.0}
+
+    def measure_api(self, endpoint, concurrency, requests, send):
+        """Send ``requests`` requests from ``concurrency`` threads, one client each"""
+        # Untimed requests build the normalizer, batcher and connections first
+        warm = Client()
+        for i in range(WARMUP_REQUESTS):
+            send(warm, requests + i)
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        counter = iter(range(requests))
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with lock:
+                        i = next(counter, None)
+                    if i is None:
+                        return
+                    started = time.perf_counter()
+                    response = send(client, i)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        if response.status_code != 200:
+                            errors.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        summary = latency_summary(latencies, len(errors), time.perf_counter() - started)
+        return {'endpoint': endpoint, 'concurrency': concurrency, **summary}
+
+    def print_result(self, result):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{result['rows']} reviews"))
+        for stage in ('load', 'clean_data', 'predict_sentiment'):
+            if stage in result:
+                self.stdout.write(
+                    f"  {stage:>17}: {result[stage]['rows_per_second']:,.0f} rows/s "
+                    f"({result[stage]['seconds']:.2f} s)")
+        for api in result.get('api', []):
+            line = (
+                f"  {api['endpoint']:>11} x{api['concurrency']:<3}: "
+                f"{api['requests_per_second']:,.0f} req/s, p50 {api['p50_ms']:.1f} ms, "
+                f"p95 {api['p95_ms']:.1f} ms, p99 {api['p99_ms']:.1f} ms"
+            )
+            if api['errors']:
+                self.stdout.write(self.style.ERROR(f"{line}, {api['errors']} errors"))
+            else:
+                self.stdout.write(line)
+
+    def compare(self, baseline, report, max_regression):
+        """Print the change against an earlier run; fail beyond ``max_regression`` percent"""
+        def measurements(results):
+            found = {}
+            for result in results:
+                for stage in ('clean_data', 'predict_sentiment'):
+                    if stage in result:
+                        found[(result['rows'], stage, 'rows/s')] = result[stage]['rows_per_second']
+                for api in result.get('api', []):
+                    key = (result['rows'], f"{api['endpoint']} x{api['concurrency']}", 'p95 ms')
+                    found[key] = api['p95_ms']
+            return found
+
+        before = measurements(baseline.get('results', []))
+        after = measurements(report['results'])
+        regressions = []
+        self.stdout.write(self.style.MIGRATE_HEADING('Change against baseline'))
+        for key in sorted(before.keys() & after.keys(), key=str):
+            rows, stage, unit = key
+            if not before[key]:
+                continue
+            change = (after[key] - before[key]) / before[key] * 100
+            # Higher throughput is better, higher latency is worse
+            worse = -change if unit == 'rows/s' else change
+            line = f'  {rows:>8} {stage:>22}: {before[key]:,.1f} -> {after[key]:,.1f} {unit} ({change:+.1f}%)'
+            if max_regression is not None and worse > max_regression:
+                regressions.append(line.strip())
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f'{len(regressions)} measurements regressed by more than {max_regression}%')
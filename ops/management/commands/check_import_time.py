@@ -0,0 +1,154 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Libraries only some code paths need; none should load at startup
+HEAVY_MODULES = (
+    'torch', 'transformers', 'optimum', 'onnxruntime', 'nltk', 'selenium',
+    'webdriver_manager', 'bs4', 'lxml', 'httpx',
+)
+
+# Runs in a fresh interpreter under -X importtime. Startup is what a web
+# worker does before its first request; the project's management command
+# modules are imported afterwards, the way manage.py loads one.
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - started
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.urls import get_resolver
+get_internal_wsgi_application()
+get_resolver().url_patterns
+startup = time.perf_counter() - started
+from django.core.management import get_commands, load_command_class
+names = [(app, name) for name, app in get_commands().items() if app in sys.argv[1:]]
+for app, name in names:
+    load_command_class(app, name)
+json.dump({
+    'setup_seconds': setup,
+    'startup_seconds': startup,
+    'commands_seconds': time.perf_counter() - started - startup,
+    'commands': len(names),
+}, sys.stdout)
+'''
+
+
+def parse_importtime(output):
+    """``(module, self_us, cumulative_us, depth)`` per line of -X importtime output"""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        imports.append((module, int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+    return imports
+
+
+def importers(imports, index):
+    """Modules that (transitively) imported ``imports[index]``, innermost first"""
+    chain = []
+    depth = imports[index][3]
+    # Children are printed before their parent, one level deeper
+    for module, _, _, parent_depth in imports[index + 1:]:
+        if parent_depth < depth:
+            chain.append(module)
+            depth = parent_depth
+    return chain
+
+
+class Command(BaseCommand):
+    help = (
+        'Reports import time of worker startup (django.setup, URLconf, WSGI app) and of the '
+        'management commands, failing if it is too slow or loads heavy ML/scraping libraries'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-seconds', type=float, default=1.0,
+            help='Fail if worker startup takes longer than this')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Startups measured; the fastest is reported')
+        parser.add_argument(
+            '--top', type=int, default=15,
+            help='Slowest imports to list')
+        parser.add_argument(
+            '--allow', nargs='+', default=[], metavar='MODULE',
+            help='Heavy modules to accept at startup')
+        parser.add_argument(
+            '--json', metavar='FILE',
+            help='Also write the report as JSON to FILE')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        project_apps = [
+            config.name for config in apps.get_app_configs()
+            if config.path.startswith(str(settings.BASE_DIR))
+        ]
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+
+        runs = []
+        for _ in range(kwargs['repeat']):
+            proc = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, *project_apps],
+                capture_output=True, text=True, env=env, cwd=settings.BASE_DIR)
+            if proc.returncode != 0:
+                raise CommandError(f'Startup failed:\n{proc.stderr[-2000:]}')
+            runs.append((json.loads(proc.stdout), proc.stderr))
+        timings, output = min(runs, key=lambda run: run[0]['startup_seconds'])
+        imports = parse_importtime(output)
+
+        heavy = []
+        for i, (module, _, cumulative_us, _) in enumerate(imports):
+            if module in HEAVY_MODULES and module not in kwargs['allow']:
+                heavy.append({
+                    'module': module,
+                    'ms': cumulative_us / 1000,
+                    'imported_by': [m for m in importers(imports, i) if m.split('.')[0] in project_apps],
+                })
+
+        self.stdout.write(
+            f"Worker startup: {timings['startup_seconds']:.2f} s "
+            f"(django.setup {timings['setup_seconds']:.2f} s), limit {kwargs['max_seconds']:.2f} s")
+        self.stdout.write(
+            f"Management commands: {timings['commands_seconds']:.2f} s more "
+            f"to import {timings['commands']} command modules")
+        self.stdout.write('Slowest imports (cumulative ms, self ms):')
+        for module, self_us, cumulative_us, _ in sorted(imports, key=lambda i: -i[2])[:kwargs['top']]:
+            self.stdout.write(f'  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {module}')
+
+        for entry in heavy:
+            via = ' <- '.join(entry['imported_by']) or 'a third-party package'
+            self.stdout.write(self.style.ERROR(
+                f"{entry['module']} loaded at startup ({entry['ms']:.0f} ms) via {via}"))
+
+        if kwargs['json']:
+            with open(kwargs['json'], 'w') as f:
+                json.dump({
+                    **timings,
+                    'max_seconds': kwargs['max_seconds'],
+                    'heavy': heavy,
+                    'imports': [
+                        {'module': module, 'self_us': self_us, 'cumulative_us': cumulative_us}
+                        for module, self_us, cumulative_us, _ in imports
+                    ],
+                }, f, indent=2)
+
+        problems = []
+        if timings['startup_seconds'] > kwargs['max_seconds']:
+            problems.append(f"startup took {timings['startup_seconds']:.2f} s")
+        if heavy:
+            problems.append(f"heavy modules loaded: {', '.join(entry['module'] for entry in heavy)}")
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Startup imports are within budget.'))
@@ -1,43 +1,114 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from scraper.models import ScrapedData, CleanedData
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-import string
+from preprocessing.normalizer import get_normalizer
+from preprocessing.workers import init_worker, clean_chunk
+from smart_text_pipeline import metrics
+from smart_text_pipeline.metrics import timer
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import time
 
 class Command(BaseCommand):
     help = 'Cleans raw reviews and saves them to CleanedData'
 
-    def handle(self, *args, **kwargs):
-        lemmatizer = WordNetLemmatizer()
-        stop_words = set(stopwords.words('english'))
-        count = 0
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Reviews cleaned and saved per transaction')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Worker processes used for cleaning (1 cleans in this process)')
+        parser.add_argument(
+            '--metrics-file', metavar='FILE',
+            help='Write Prometheus metrics for this run to FILE (node_exporter textfile format)')
 
-        scraped_reviews = ScrapedData.objects.all()
-
-        for scraped in scraped_reviews:
-            text = scraped.raw_text
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        workers = kwargs['workers']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
 
-            # Lowercase
-            text = text.lower()
+        version = settings.CLEANING_VERSION
+        count = 0
 
-            # Remove punctuation
-            text = text.translate(str.maketrans('', '', string.punctuation))
+        chunks = self.iter_chunks(batch_size, version)
+        normalizer = None
+        if workers > 1:
+            results = self.clean_in_pool(chunks, workers)
+        else:
+            normalizer = get_normalizer()
+            results = (
+                [(pk, normalizer.normalize(text)) for pk, text in chunk]
+                for chunk in chunks
+            )
 
-            # Tokenize
-            tokens = word_tokenize(text)
+        started = time.perf_counter()
+        for cleaned_pairs in results:
+            # Time spent reading and cleaning this chunk (or waiting for the pool)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='clean_data.clean')
+            with timer('clean_data.db_write'), transaction.atomic():
+                CleanedData.objects.bulk_create([
+                    CleanedData(
+                        scraped_id=pk,
+                        cleaned_text=cleaned,
+                        cleaning_version=version
+                    )
+                    for pk, cleaned in cleaned_pairs
+                ])
+            count += len(cleaned_pairs)
+            metrics.record_batch('clean_data', len(cleaned_pairs), time.perf_counter() - started)
+            started = time.perf_counter()
 
-            # Remove stop words & lemmatize
-            tokens = [lemmatizer.lemmatize(word) for word in tokens if word not in stop_words]
+        self.stdout.write(self.style.SUCCESS(f'Successfully cleaned and saved {count} reviews.'))
+        if normalizer is not None:
+            info = normalizer.cache_info()
+            self.stdout.write(
+                f"Lemma cache: {info['hit_rate']:.1%} hit rate "
+                f"({info['hits']} hits, {info['misses']} misses, {info['size']} entries)")
+        if kwargs['metrics_file']:
+            metrics.write_textfile(kwargs['metrics_file'])
 
-            cleaned = " ".join(tokens)
+    def iter_chunks(self, batch_size, version):
+        """Yield lists of (id, raw_text) for reviews not yet cleaned with this version"""
+        already_cleaned = CleanedData.objects.filter(
+            scraped=OuterRef('pk'), cleaning_version=version)
 
-            # Save cleaned text
-            CleanedData.objects.create(
-                scraped=scraped,
-                cleaned_text=cleaned
+        # The cursor only pages through this run. No id checkpoint is kept
+        # between runs: rows can commit out of id order, and the anti-join
+        # alone lets a killed run resume.
+        last_id = 0
+        while True:
+            chunk = list(
+                ScrapedData.objects.filter(id__gt=last_id)
+                .filter(~Exists(already_cleaned))
+                .order_by('id')
+                .values_list('id', 'raw_text')[:batch_size]
             )
-            count += 1
+            if not chunk:
+                return
+            last_id = chunk[-1][0]
+            yield chunk
 
-        self.stdout.write(self.style.SUCCESS(f'Successfully cleaned and saved {count} reviews.'))
+    def clean_in_pool(self, chunks, workers):
+        """Clean chunks in worker processes, yielding results in input order"""
+        # Spawned workers don't inherit the parent's database connection
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+                max_workers=workers, mp_context=context, initializer=init_worker,
+                initargs=(settings.NORMALIZER_LEMMA_CACHE_SIZE,)) as pool:
+            # Keep a couple of chunks queued per worker so no core sits idle
+            # while the parent is reading or writing, without reading ahead
+            # through the whole table
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(clean_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
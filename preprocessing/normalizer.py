@@ -0,0 +1,84 @@
+"""
+Text normalisation shared by the clean_data command and the API.
+
+``get_normalizer()`` returns one ``TextNormalizer`` per process. It holds the
+punctuation table, a frozen stop-word set and an LRU cache of lemmas, so the
+NLTK resources are built once instead of on every review or request. NLTK
+itself is imported by the first normalizer, not when this module loads, so
+URL loading and commands that never clean text don't pay for it.
+"""
+import string
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from smart_text_pipeline.metrics import register_collector
+
+
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+_normalizer = None
+_normalizer_lock = threading.Lock()
+
+
+class TextNormalizer:
+    """Lowercase, strip punctuation, tokenize, drop stop words and lemmatize"""
+
+    def __init__(self, lemma_cache_size=None):
+        from nltk.corpus import stopwords
+        from nltk.stem import WordNetLemmatizer
+        from nltk.tokenize import word_tokenize
+
+        if lemma_cache_size is None:
+            lemma_cache_size = settings.NORMALIZER_LEMMA_CACHE_SIZE
+        self._tokenize = word_tokenize
+        self.stop_words = frozenset(stopwords.words('english'))
+        lemmatizer = WordNetLemmatizer()
+        # Review vocabulary is heavily skewed, so a bounded cache of
+        # token -> lemma answers most lookups without touching WordNet
+        self._lemmatize = lru_cache(maxsize=lemma_cache_size)(lemmatizer.lemmatize)
+        # WordNet is read lazily; load it here rather than on the first review
+        lemmatizer.lemmatize('review')
+
+    def normalize(self, text):
+        text = text.lower().translate(PUNCTUATION_TABLE)
+        tokens = self._tokenize(text)
+        lemmatize = self._lemmatize
+        stop_words = self.stop_words
+        return " ".join(lemmatize(word) for word in tokens if word not in stop_words)
+
+    def cache_info(self):
+        """Lemma cache statistics, including the hit rate"""
+        info = self._lemmatize.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'maxsize': info.maxsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0,
+        }
+
+
+def get_normalizer():
+    """Return the process-wide normalizer, building it on first use"""
+    global _normalizer
+    if _normalizer is None:
+        with _normalizer_lock:
+            if _normalizer is None:
+                _normalizer = TextNormalizer()
+    return _normalizer
+
+
+def collect_metrics():
+    if _normalizer is None:
+        return []
+    info = _normalizer.cache_info()
+    return [
+        ('stp_lemma_cache_hits_total', 'counter', 'Lemma cache hits', {}, info['hits']),
+        ('stp_lemma_cache_misses_total', 'counter', 'Lemma cache misses', {}, info['misses']),
+        ('stp_lemma_cache_entries', 'gauge', 'Lemmas held in the cache', {}, info['size']),
+    ]
+
+
+register_collector(collect_metrics)
@@ -1,3 +1,104 @@
-from django.test import TestCase
+import string
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from scraper.models import CleanedData, ScrapedData
+
+from .normalizer import TextNormalizer
+
+
+def nltk_data_installed():
+    import nltk
+
+    try:
+        for resource in ('corpora/stopwords', 'corpora/wordnet', 'tokenizers/punkt_tab'):
+            nltk.data.find(resource)
+    except LookupError:
+        return False
+    return True
+
+
+def baseline_clean(text):
+    """The cleaning clean_data did per review before TextNormalizer"""
+    from nltk.corpus import stopwords
+    from nltk.stem import WordNetLemmatizer
+    from nltk.tokenize import word_tokenize
+
+    lemmatizer = WordNetLemmatizer()
+    stop_words = set(stopwords.words('english'))
+    text = text.lower()
+    text = text.translate(str.maketrans('', '', string.punctuation))
+    tokens = word_tokenize(text)
+    tokens = [lemmatizer.lemmatize(word) for word in tokens if word not in stop_words]
+    return " ".join(tokens)
+
+
+REVIEWS = [
+    "This movie was absolutely BRILLIANT!!! The actors' performances were stunning.",
+    "I didn't like it... the plot holes were everywhere, and the ending? Terrible.",
+    "Inception (2010) is a mind-bending film; Nolan's best work, 10/10 would watch again.",
+    "Dreams within dreams within dreams. The spinning top at the end -- did it fall?",
+    "   Leaves, wolves, knives and geese: the children's feet were running through the cities.  ",
+    "Café scenes in Paris were beautiful — naïve viewers may miss the déjà vu references 😀",
+    "<br/><br/>Spoilers ahead: Cobb's totem is his wife's, not his own.\n\nStill great.",
+    "It's a 2h28m film with $160M budget & a Hans Zimmer score... BWAAAM!",
+    "movies movies movies, the best movies are the movies that make you think about movies",
+    "",
+    "!!!???...",
+]
+
+
+@skipUnless(nltk_data_installed(), 'NLTK stopwords, wordnet and punkt_tab data are not installed')
+class TextNormalizerTests(SimpleTestCase):
+    def test_output_matches_the_baseline_cleaning(self):
+        expected = [baseline_clean(review) for review in REVIEWS]
+        for cache_size in (None, 1, 0):
+            normalizer = TextNormalizer(lemma_cache_size=cache_size)
+            # Twice, so the second pass is answered from the lemma cache
+            for _ in range(2):
+                self.assertEqual([normalizer.normalize(review) for review in REVIEWS], expected)
+
+
+class LowercaseNormalizer:
+    """Stands in for TextNormalizer where only row selection matters"""
+
+    def normalize(self, text):
+        return text.lower()
+
+    def cache_info(self):
+        return {'hits': 0, 'misses': 0, 'size': 0, 'hit_rate': 0.0}
+
+
+@override_settings(CLEANING_VERSION=2)
+@mock.patch('preprocessing.management.commands.clean_data.get_normalizer', LowercaseNormalizer)
+class CleanDataCommandTests(TestCase):
+    def clean(self):
+        out = StringIO()
+        call_command('clean_data', stdout=out)
+        return out.getvalue()
+
+    def scraped(self, text, **kwargs):
+        return ScrapedData.objects.create(
+            source_url='https://www.imdb.com/review', raw_text=text, **kwargs)
+
+    def test_rows_committed_out_of_id_order_are_cleaned(self):
+        self.scraped('An awful film', pk=10)
+        self.clean()
+        # Committed after the first run, with a lower id
+        late = self.scraped('A great film', pk=5)
+
+        self.assertIn('cleaned and saved 1 reviews', self.clean())
+        self.assertEqual(CleanedData.objects.get(scraped=late).cleaned_text, 'a great film')
+
+    def test_reviews_are_cleaned_once_per_version(self):
+        scraped = self.scraped('A great film')
+        CleanedData.objects.create(scraped=scraped, cleaned_text='old', cleaning_version=1)
+
+        self.clean()
+        self.clean()
+        self.assertQuerySetEqual(
+            CleanedData.objects.filter(scraped=scraped).order_by('cleaning_version')
+            .values_list('cleaning_version', 'cleaned_text'),
+            [(1, 'old'), (2, 'a great film')])
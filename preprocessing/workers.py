@@ -0,0 +1,23 @@
+"""
+Process-pool helpers for the clean_data command.
+
+Each worker builds its normalizer once in ``init_worker`` and then cleans
+chunks of ``(id, raw_text)`` pairs sent by the parent process. Nothing here
+touches the database, so workers never open a connection of their own.
+"""
+from preprocessing.normalizer import TextNormalizer
+
+
+_normalizer = None
+
+
+def init_worker(lemma_cache_size=None):
+    """Build the normalizer (and load NLTK resources) once per process"""
+    global _normalizer
+    _normalizer = TextNormalizer(lemma_cache_size)
+
+
+def clean_chunk(chunk):
+    """Clean a list of ``(id, raw_text)`` pairs into ``(id, cleaned_text)`` pairs"""
+    normalize = _normalizer.normalize
+    return [(pk, normalize(text)) for pk, text in chunk]
@@ -0,0 +1,75 @@
+"""
+A fixed pool of reusable WebDriver instances for scrape_imdb.
+
+Drivers are started once, each one owned by a worker thread that takes URLs
+from a shared queue until it is empty, so a multi-title job pays the browser
+start-up cost ``size`` times instead of once per title.
+"""
+import queue
+import threading
+import time
+from collections import namedtuple
+
+
+JobResult = namedtuple('JobResult', ['item', 'value', 'error', 'elapsed'])
+
+
+class BrowserPool:
+    """Runs ``job(driver, item)`` for many items on ``size`` shared drivers"""
+
+    def __init__(self, size, make_driver):
+        self.size = size
+        self.make_driver = make_driver
+        self.drivers = []
+
+    def __enter__(self):
+        try:
+            for _ in range(self.size):
+                self.drivers.append(self.make_driver())
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for driver in self.drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        self.drivers = []
+
+    def run(self, job, items):
+        """Yield a JobResult per item, in completion order"""
+        items = list(items)
+        jobs = queue.Queue()
+        for item in items:
+            jobs.put(item)
+        results = queue.Queue()
+
+        def worker(driver):
+            while True:
+                try:
+                    item = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.monotonic()
+                try:
+                    value, error = job(driver, item), None
+                except Exception as e:
+                    value, error = None, e
+                results.put(JobResult(item, value, error, time.monotonic() - started))
+
+        threads = [
+            threading.Thread(target=worker, args=(driver,), name=f'browser-{i}', daemon=True)
+            for i, driver in enumerate(self.drivers)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in items:
+            yield results.get()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,172 @@
+"""
+Concurrent HTTP review fetcher for scrape_imdb.
+
+Review pages and their "load more" pages are requested directly from IMDB's
+``/reviews/_ajax`` endpoint with asyncio and httpx, so no browser is needed.
+Requests to each host are capped by a concurrency limit and spaced out by a
+minimum interval; 429s, 5xx responses and timeouts are retried a bounded
+number of times with exponential backoff (or the server's Retry-After). Parsing is delegated to an extraction backend from
+scraper.parsers, so both modes produce the same review dicts.
+"""
+import asyncio
+import queue
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+)
+
+# Worth asking again: rate limited or a transient server error
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_DONE = object()
+
+
+class HostLimiter:
+    """Caps concurrent requests to one host and spaces out their start times"""
+
+    def __init__(self, concurrency, min_interval):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.min_interval = min_interval
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+
+class ReviewFetcher:
+    """Fetches and parses review pages for many titles concurrently"""
+
+    def __init__(self, backend, base_url=None, concurrency=4, rate=2.0,
+                 max_pages=10, timeout=20, save_dir=None, max_retries=3, backoff=1.0,
+                 max_backoff=60.0):
+        # ``backend.extract_page(html)`` returns (reviews, pagination_key)
+        self.backend = backend
+        self.base_url = (base_url or settings.IMDB_BASE_URL).rstrip('/')
+        self.concurrency = concurrency
+        self.min_interval = 1.0 / rate if rate else 0.0
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.save_dir = Path(save_dir) if save_dir else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._limiters = {}
+
+    def source_url(self, title_id):
+        return f"{self.base_url}/title/{title_id}/reviews"
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._limiters:
+            self._limiters[host] = HostLimiter(self.concurrency, self.min_interval)
+        return self._limiters[host]
+
+    def retry_delay(self, attempt, response=None):
+        """Seconds to wait before retry number ``attempt + 1``"""
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        if retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff * 2 ** attempt
+        return min(delay, self.max_backoff)
+
+    async def _get(self, client, url, params):
+        import httpx
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                # Retries go through the limiter too, so they stay polite
+                async with self._limiter(url):
+                    response = await client.get(url, params=params)
+            except httpx.TimeoutException:
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self.retry_delay(attempt))
+                continue
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                break
+            await asyncio.sleep(self.retry_delay(attempt, response))
+        response.raise_for_status()
+        return response.text
+
+    async def fetch_title(self, client, title_id):
+        """Return every review of one title, following "load more" keys"""
+        url = f"{self.source_url(title_id)}/_ajax"
+        reviews = []
+        key = None
+        for page in range(self.max_pages):
+            params = {'paginationKey': key} if key else None
+            html = await self._get(client, url, params)
+            if self.save_dir:
+                (self.save_dir / f"{title_id}_{page}.html").write_text(html, encoding='utf-8')
+            # Parsing is CPU-bound; keep the event loop free for other requests
+            page_reviews, key = await asyncio.to_thread(self.backend.extract_page, html)
+            reviews.extend(page_reviews)
+            if not key:
+                break
+        return reviews
+
+    async def _fetch_all(self, title_ids, on_result):
+        import httpx
+
+        if self.save_dir:
+            self.save_dir.mkdir(parents=True, exist_ok=True)
+        limits = httpx.Limits(max_connections=self.concurrency * 2)
+        async with httpx.AsyncClient(
+                headers={'User-Agent': USER_AGENT}, timeout=self.timeout,
+                limits=limits, follow_redirects=True) as client:
+
+            async def run(title_id):
+                try:
+                    result = await self.fetch_title(client, title_id)
+                except Exception as e:
+                    result = e
+                await asyncio.to_thread(on_result, title_id, result)
+
+            await asyncio.gather(*(run(title_id) for title_id in title_ids))
+
+    def iter_results(self, title_ids, max_pending=16):
+        """
+        Yield ``(title_id, source_url, reviews_or_exception)`` as titles finish.
+
+        The event loop runs in a background thread; results are handed over
+        through a bounded queue, so the caller can save them with the (sync)
+        ORM while other titles are still downloading.
+        """
+        results = queue.Queue(maxsize=max_pending)
+
+        def loop():
+            try:
+                asyncio.run(self._fetch_all(
+                    title_ids, lambda title_id, result: results.put((title_id, result))))
+            finally:
+                results.put(_DONE)
+
+        thread = threading.Thread(target=loop, name='review-fetcher', daemon=True)
+        thread.start()
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            title_id, result = item
+            yield title_id, self.source_url(title_id), result
+        thread.join()
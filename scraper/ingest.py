@@ -0,0 +1,45 @@
+"""
+Deduplicating bulk ingestion of scraped reviews.
+
+Every review is identified by ``(source_url, content_hash)``. Reviews already
+stored are skipped before insert, and the insert itself uses
+``ON CONFLICT DO NOTHING`` so concurrent scrapes of the same page can't create
+duplicates either. Re-scraping a page therefore costs one lookup query and
+no downstream cleaning or prediction work.
+"""
+from scraper.models import ScrapedData, content_hash
+
+
+def ingest_reviews(source_url, reviews, batch_size=500):
+    """
+    Save ``{'title': ..., 'text': ...}`` dicts for one page, skipping duplicates.
+
+    Returns the ScrapedData objects that were new (their ids are not set).
+    """
+    new_rows = []
+    seen = set()
+    for review in reviews:
+        digest = content_hash(review['text'])
+        if digest in seen:
+            continue
+        seen.add(digest)
+        new_rows.append(ScrapedData(
+            source_url=source_url,
+            review_title=review['title'],
+            raw_text=review['text'],
+            content_hash=digest,
+        ))
+
+    saved = []
+    for start in range(0, len(new_rows), batch_size):
+        batch = new_rows[start:start + batch_size]
+        existing = set(
+            ScrapedData.objects.filter(
+                source_url=source_url,
+                content_hash__in=[row.content_hash for row in batch],
+            ).values_list('content_hash', flat=True)
+        )
+        batch = [row for row in batch if row.content_hash not in existing]
+        ScrapedData.objects.bulk_create(batch, ignore_conflicts=True)
+        saved.extend(batch)
+    return saved
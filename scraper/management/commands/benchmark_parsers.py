@@ -0,0 +1,76 @@
+import glob
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from scraper.parsers import BACKENDS, SoupBackend, get_backend
+
+
+DEFAULT_FIXTURES = str(Path(__file__).resolve().parents[2] / 'testdata' / '*.html')
+
+
+class Command(BaseCommand):
+    help = 'Compares HTML extraction backends on saved IMDB review pages (speed and identical output)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'fixtures', nargs='*', default=[DEFAULT_FIXTURES],
+            help='HTML files or glob patterns (default: scraper/testdata/*.html)')
+        parser.add_argument(
+            '--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS),
+            help='Backends to benchmark; output is compared against soup')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Times each page is parsed per backend')
+        parser.add_argument(
+            '--json', metavar='FILE',
+            help='Also write the results as JSON to FILE')
+
+    def handle(self, *args, **kwargs):
+        paths = sorted({p for pattern in kwargs['fixtures'] for p in glob.glob(pattern)})
+        if not paths:
+            raise CommandError('No fixture files found')
+        pages = {path: Path(path).read_text(encoding='utf-8') for path in paths}
+        repeat = kwargs['repeat']
+
+        # Reference output from the original BeautifulSoup extraction
+        reference = {path: SoupBackend().extract_page(html) for path, html in pages.items()}
+
+        results = []
+        for name in kwargs['backends']:
+            backend = get_backend(name)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for html in pages.values():
+                    backend.extract_page(html)
+            elapsed = time.perf_counter() - started
+
+            mismatches = [
+                path for path, html in pages.items()
+                if backend.extract_page(html) != reference[path]
+            ]
+            results.append({
+                'backend': name,
+                'pages': len(pages) * repeat,
+                'seconds': elapsed,
+                'ms_per_page': elapsed * 1000 / (len(pages) * repeat),
+                'identical': not mismatches,
+                'mismatches': mismatches,
+            })
+
+        baseline = results[0]['seconds']
+        for result in results:
+            line = (
+                f"{result['backend']:>6}: {result['ms_per_page']:.2f} ms/page, "
+                f"{baseline / result['seconds']:.1f}x vs {results[0]['backend']}, "
+            )
+            if result['identical']:
+                self.stdout.write(self.style.SUCCESS(line + 'output identical'))
+            else:
+                self.stdout.write(self.style.ERROR(
+                    line + f"output differs on: {', '.join(result['mismatches'])}"))
+
+        if kwargs['json']:
+            with open(kwargs['json'], 'w') as f:
+                json.dump(results, f, indent=2)
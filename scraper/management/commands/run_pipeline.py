@@ -0,0 +1,110 @@
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ml_model.registry import get_model
+from scraper.fetcher import ReviewFetcher
+from scraper.parsers import BACKENDS, get_backend
+from scraper.pipeline import Pipeline
+
+
+class Command(BaseCommand):
+    help = 'Scrapes, cleans and classifies reviews as concurrent stages connected by bounded queues'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--titles', nargs='+', required=True,
+            help='IMDB title ids to scrape')
+        parser.add_argument(
+            '--model', default=settings.SENTIMENT_DEFAULT_MODEL,
+            help='Model name from SENTIMENT_MODELS (stored in Prediction.model_name)')
+        parser.add_argument(
+            '--parser', choices=list(BACKENDS), default=None,
+            help='HTML extraction backend (default: SCRAPER_PARSER_BACKEND)')
+        parser.add_argument(
+            '--max-pages', type=int, default=10,
+            help='Review pages fetched per title')
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Scrape stage: concurrent requests per host')
+        parser.add_argument(
+            '--rate', type=float, default=2.0,
+            help='Scrape stage: maximum requests started per second per host')
+        parser.add_argument(
+            '--clean-workers', type=int, default=1,
+            help='Clean stage: worker processes (1 cleans in a thread)')
+        parser.add_argument(
+            '--predict-workers', type=int, default=1,
+            help='Predict stage: threads running the classifier and saving results')
+        parser.add_argument(
+            '--batch-size', type=int, default=32,
+            help='Predict stage: reviews per model call and bulk insert')
+        parser.add_argument(
+            '--flush-interval', type=float, default=0.5,
+            help='Predict stage: seconds to wait for a batch to fill up')
+        parser.add_argument(
+            '--queue-size', type=int, default=8,
+            help='Batches buffered between stages before upstream blocks')
+        parser.add_argument(
+            '--progress', type=float, default=10,
+            help='Seconds between progress reports (0 disables them)')
+
+    def handle(self, *args, **kwargs):
+        for option in ('clean_workers', 'predict_workers', 'batch_size', 'queue_size'):
+            if kwargs[option] < 1:
+                raise CommandError(f"--{option.replace('_', '-')} must be at least 1")
+
+        try:
+            classifier = get_model(kwargs['model'])
+        except LookupError as e:
+            raise CommandError(str(e))
+
+        fetcher = ReviewFetcher(
+            get_backend(kwargs['parser']),
+            concurrency=kwargs['concurrency'],
+            rate=kwargs['rate'],
+            max_pages=kwargs['max_pages'],
+        )
+        pipeline = Pipeline(
+            fetcher,
+            classifier,
+            kwargs['model'],
+            clean_workers=kwargs['clean_workers'],
+            predict_workers=kwargs['predict_workers'],
+            batch_size=kwargs['batch_size'],
+            queue_size=kwargs['queue_size'],
+            flush_interval=kwargs['flush_interval'],
+            on_error=lambda stage, e: self.stderr.write(f'{stage}: {e}'),
+        )
+
+        done = threading.Event()
+        if kwargs['progress']:
+            reporter = threading.Thread(
+                target=self.report_progress, args=(pipeline, kwargs['progress'], done), daemon=True)
+            reporter.start()
+
+        started = time.monotonic()
+        try:
+            pipeline.run(kwargs['titles'])
+        finally:
+            done.set()
+
+        for stats in pipeline.stats:
+            self.stdout.write(stats.summary())
+        self.stdout.write(f'Padding: {pipeline.scheduler.stats.summary()}')
+        if pipeline.latencies:
+            latencies = sorted(pipeline.latencies)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(
+                f'End-to-end latency per review: median {statistics.median(latencies):.2f}s, '
+                f'p95 {p95:.2f}s, max {latencies[-1]:.2f}s')
+        self.stdout.write(self.style.SUCCESS(
+            f'Pipeline finished in {time.monotonic() - started:.1f}s: '
+            f'{pipeline.predict_stage.stats.items} reviews scored with {kwargs["model"]}.'))
+
+    def report_progress(self, pipeline, interval, done):
+        while not done.wait(interval):
+            self.stdout.write(' | '.join(
+                f'{stats.name} {stats.items} ({stats.rate():.1f}/s)' for stats in pipeline.stats))
@@ -1,73 +1,244 @@
-from django.core.management.base import BaseCommand
-from scraper.models import ScrapedData
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from scraper.ingest import ingest_reviews
+from scraper.fetcher import ReviewFetcher
+from scraper.browser_pool import BrowserPool
+from scraper.parsers import BACKENDS, get_backend
+from smart_text_pipeline import metrics
+import argparse
 import time
 
+# Any of the review container layouts handled by scraper.parsers
+REVIEW_CONTAINER_CSS = "div[data-testid='review-card'], div.review-container, div.lister-item"
+
+# Selenium and webdriver_manager are imported where the browser mode uses
+# them, so --help and http mode start without loading them
+
+
+def button_gone(button):
+    """True once a clicked button is hidden or removed from the page"""
+    from selenium.common.exceptions import StaleElementReferenceException
+
+    try:
+        return not button.is_displayed()
+    except StaleElementReferenceException:
+        return True
+
 class Command(BaseCommand):
     help = 'Scrapes IMDB movie reviews and saves title and text separately'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--titles', nargs='+', default=['tt1375666'],
+            help='IMDB title ids to scrape')
+        parser.add_argument(
+            '--mode', choices=['browser', 'http'], default='browser',
+            help="'browser' renders pages in Chrome; 'http' fetches review pages directly")
+        parser.add_argument(
+            '--parser', choices=list(BACKENDS), default=None,
+            help='HTML extraction backend (default: SCRAPER_PARSER_BACKEND)')
+        parser.add_argument(
+            '--pool-size', type=int, default=2,
+            help='browser mode: Chrome instances shared by all titles')
+        parser.add_argument(
+            '--page-timeout', type=float, default=15,
+            help='browser mode: seconds to wait for reviews to render')
+        parser.add_argument(
+            '--expand-timeout', type=float, default=5,
+            help='browser mode: seconds in all to wait for spoilers and "Show more" per page')
+        parser.add_argument(
+            '--headless', action=argparse.BooleanOptionalAction, default=True,
+            help='browser mode: run Chrome without a window')
+        parser.add_argument(
+            '--max-pages', type=int, default=10,
+            help='http mode: review pages ("load more" clicks) fetched per title')
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='http mode: concurrent requests per host')
+        parser.add_argument(
+            '--rate', type=float, default=2.0,
+            help='http mode: maximum requests started per second per host')
+        parser.add_argument(
+            '--max-retries', type=int, default=3,
+            help='http mode: retries per page after a 429, a 5xx or a timeout')
+        parser.add_argument(
+            '--save-html', metavar='DIR',
+            help='http mode: also save every fetched page to DIR')
+        parser.add_argument(
+            '--metrics-file', metavar='FILE',
+            help='Write Prometheus metrics for this run to FILE (node_exporter textfile format)')
+
     def handle(self, *args, **kwargs):
+        try:
+            if kwargs['mode'] == 'http':
+                self.handle_http(kwargs)
+            else:
+                self.handle_browser(kwargs)
+        finally:
+            if kwargs['metrics_file']:
+                metrics.write_textfile(kwargs['metrics_file'])
+
+    def handle_http(self, options):
+        """Fetch review pages over HTTP for every title concurrently"""
+        fetcher = ReviewFetcher(
+            get_backend(options['parser']),
+            concurrency=options['concurrency'],
+            rate=options['rate'],
+            max_pages=options['max_pages'],
+            save_dir=options['save_html'],
+            max_retries=options['max_retries'],
+        )
+        started = time.monotonic()
+        total = 0
+        for title_id, url, result in fetcher.iter_results(options['titles']):
+            if isinstance(result, Exception):
+                self.stdout.write(self.style.ERROR(f'Error fetching {title_id}: {result}'))
+                continue
+            count = self.save_reviews(url, result)
+            total += count
+            self.stdout.write(f'{title_id}: saved {count} new of {len(result)} reviews')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully scraped {total} reviews from {len(options["titles"])} titles in {elapsed:.1f}s.'))
+
+    def make_driver_factory(self, headless):
+        """Return a callable that starts one configured Chrome driver"""
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+        from webdriver_manager.chrome import ChromeDriverManager
+
         chrome_options = Options()
+        if headless:
+            chrome_options.add_argument("--headless=new")
         chrome_options.add_argument("--disable-extensions")
         chrome_options.add_argument("--disable-blink-features=AutomationControlled")
         chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option('useAutomationExtension', False)
 
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
-
-        try:
-            url = "https://www.imdb.com/title/tt1375666/reviews"
-            print(f"Navigating to: {url}")
-            driver.get(url)
-            time.sleep(5)
+        # Resolve the chromedriver binary once for the whole pool
+        service_path = ChromeDriverManager().install()
+        return lambda: webdriver.Chrome(service=Service(service_path), options=chrome_options)
 
-            # Handle spoiler buttons and show more buttons
-            self.handle_dynamic_content(driver)
-            
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            
-            # Try different approaches to find review containers
-            reviews_data = self.extract_reviews_with_titles(soup, driver)
-            
-            count = 0
-            for review_data in reviews_data:
-                title = review_data.get('title', '').strip()
-                text = review_data.get('text', '').strip()
-                
-                if text and len(text) > 50:  # Only save if there's substantial text
-                    ScrapedData.objects.create(
-                        source_url=url,
-                        review_title=title,
-                        raw_text=text
-                    )
-                    count += 1
-                    print(f"Saved review {count}:")
-                    print(f"  Title: {title[:100]}...")
-                    print(f"  Text: {text[:100]}...")
-                    print("-" * 50)
-
-            self.stdout.write(self.style.SUCCESS(f'Successfully scraped {count} reviews with titles.'))
+    def handle_browser(self, options):
+        """Scrape every title on a fixed pool of reusable browsers"""
+        urls = [f"{settings.IMDB_BASE_URL}/title/{title_id}/reviews" for title_id in options['titles']]
+        if options['pool_size'] < 1:
+            raise CommandError('--pool-size must be at least 1')
+        pool_size = min(options['pool_size'], len(urls))
+        page_timeout = options['page_timeout']
+        expand_timeout = options['expand_timeout']
+        backend = get_backend(options['parser'])
 
+        started = time.monotonic()
+        total = 0
+        try:
+            with BrowserPool(pool_size, self.make_driver_factory(options['headless'])) as pool:
+                jobs = pool.run(
+                    lambda driver, url: self.scrape_page(
+                        driver, url, page_timeout, backend, expand_timeout),
+                    urls)
+                for url, value, error, elapsed in jobs:
+                    if error is not None:
+                        self.stdout.write(self.style.ERROR(f'Error scraping {url}: {error}'))
+                        continue
+                    reviews_data, timings = value
+                    for step, seconds in timings.items():
+                        metrics.STAGE_SECONDS.observe(seconds, stage=f'scrape_imdb.{step}')
+                    count = self.save_reviews(url, reviews_data)
+                    total += count
+                    self.stdout.write(
+                        f"{url}: saved {count} new reviews in {elapsed:.1f}s "
+                        f"(load {timings['load']:.1f}s, expand {timings['expand']:.1f}s, "
+                        f"parse {timings['parse']:.1f}s)")
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error occurred: {str(e)}'))
             import traceback
             traceback.print_exc()
-        finally:
-            driver.quit()
+            return
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully scraped {total} reviews with titles from {len(urls)} pages '
+            f'in {elapsed:.1f}s using {pool_size} browsers.'))
+
+    def scrape_page(self, driver, url, timeout, backend, expand_timeout):
+        """Load one review page and return (reviews, per-step timings)"""
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        timings = {}
 
-    def handle_dynamic_content(self, driver):
-        """Handle spoiler buttons and dynamic content loading"""
+        step = time.monotonic()
+        driver.get(url)
+        # Wait for the first review card instead of a fixed sleep
         try:
-            # Click spoiler buttons
+            WebDriverWait(driver, timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, REVIEW_CONTAINER_CSS)))
+        except TimeoutException:
+            pass
+        timings['load'] = time.monotonic() - step
+
+        # Handle spoiler buttons and show more buttons
+        step = time.monotonic()
+        self.handle_dynamic_content(driver, expand_timeout)
+        timings['expand'] = time.monotonic() - step
+
+        step = time.monotonic()
+        # Try different approaches to find review containers
+        reviews_data, _ = backend.extract_page(driver.page_source)
+        timings['parse'] = time.monotonic() - step
+
+        return reviews_data, timings
+
+    def save_reviews(self, url, reviews_data):
+        """Save new reviews with substantial text, returning how many were saved"""
+        reviews = []
+        for review_data in reviews_data:
+            title = review_data.get('title', '').strip()
+            text = review_data.get('text', '').strip()
+            
+            if text and len(text) > 50:  # Only save if there's substantial text
+                reviews.append({'title': title, 'text': text})
+
+        # Reviews already stored for this page are skipped, not duplicated
+        started = time.perf_counter()
+        saved = len(ingest_reviews(url, reviews))
+        elapsed = time.perf_counter() - started
+        metrics.STAGE_SECONDS.observe(elapsed, stage='scrape_imdb.save')
+        metrics.record_batch('scrape_imdb', len(reviews), elapsed)
+        return saved
+
+    def handle_dynamic_content(self, driver, timeout=5):
+        """Handle spoiler buttons and dynamic content loading, within ``timeout`` seconds in all"""
+        from selenium.common.exceptions import (
+            StaleElementReferenceException, TimeoutException, WebDriverException)
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        # One budget for the whole page, so many buttons cannot each wait the
+        # full timeout; once it is spent, remaining buttons are clicked
+        # without waiting for their effect
+        deadline = time.monotonic() + timeout
+
+        def wait_until(condition):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                WebDriverWait(driver, remaining, poll_frequency=0.1).until(condition)
+            except TimeoutException:
+                pass
+
+        def count_reviews(d):
+            return len(d.find_elements(By.CSS_SELECTOR, REVIEW_CONTAINER_CSS))
+
+        try:
+            # Click spoiler buttons, waiting until each one has been handled
             spoiler_buttons = driver.find_elements(By.XPATH, 
                 "//button[contains(text(), 'spoiler') or contains(@class, 'spoiler')]")
             
@@ -75,165 +246,28 @@ class Command(BaseCommand):
                 try:
                     if button.is_displayed():
                         driver.execute_script("arguments[0].click();", button)
-                        time.sleep(1)
-                except:
+                        wait_until(lambda d: button_gone(button))
+                except StaleElementReferenceException:
+                    # Removed from the page since it was found
                     pass
 
-            # Click "Show more" buttons
+            # Click "Show more" buttons, waiting for new reviews to appear
             show_more_buttons = driver.find_elements(By.XPATH, 
                 "//button[contains(text(), 'Show more') or contains(@class, 'show-more')]")
             
             for button in show_more_buttons:
                 try:
                     if button.is_displayed():
+                        before = count_reviews(driver)
                         driver.execute_script("arguments[0].click();", button)
-                        time.sleep(1)
-                except:
+                        wait_until(lambda d: count_reviews(d) > before or button_gone(button))
+                except StaleElementReferenceException:
                     pass
 
-            # Scroll to load more content
+            # Scroll to load more content, waiting only while the page grows
+            height = driver.execute_script("return document.body.scrollHeight;")
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(3)
+            wait_until(lambda d: d.execute_script("return document.body.scrollHeight;") > height)
 
-        except Exception as e:
+        except WebDriverException as e:
             print(f"Error handling dynamic content: {e}")
-
-    def extract_reviews_with_titles(self, soup, driver):
-        """Extract reviews with separate title and text"""
-        reviews_data = []
-        
-        # Method 1: Try modern IMDB structure
-        review_containers = soup.find_all('div', {'data-testid': 'review-card'})
-        if not review_containers:
-            review_containers = soup.find_all('div', class_='review-container')
-        if not review_containers:
-            review_containers = soup.find_all('div', class_='lister-item')
-        
-        print(f"Found {len(review_containers)} review containers")
-        
-        for container in review_containers:
-            try:
-                # Extract title - try multiple selectors
-                title = self.extract_title(container)
-                
-                # Extract review text - try multiple selectors
-                text = self.extract_text(container)
-                
-                if title or text:
-                    reviews_data.append({
-                        'title': title,
-                        'text': text
-                    })
-                    
-            except Exception as e:
-                print(f"Error extracting from container: {e}")
-                continue
-        
-        # Method 2: If no structured containers found, try alternative approach
-        if not reviews_data:
-            reviews_data = self.extract_reviews_alternative(soup)
-        
-        return reviews_data
-
-    def extract_title(self, container):
-        """Extract review title from container"""
-        title_selectors = [
-            'a.title',
-            'h3 a',
-            'div[data-testid="review-title"]',
-            '.review-title',
-            '.titleReviewBarItem .titleReviewBarSubItem .title',
-            'a[href*="review"]',
-            '.ipc-title__text',
-            'h4 a'
-        ]
-        
-        for selector in title_selectors:
-            try:
-                if selector.startswith('.') or selector.startswith('['):
-                    title_elem = container.select_one(selector)
-                else:
-                    title_elem = container.find(selector.split()[0], class_=selector.split('.')[1] if '.' in selector else None)
-                
-                if title_elem:
-                    title = title_elem.get_text(strip=True)
-                    if title and len(title) > 5:
-                        return title
-            except:
-                continue
-        
-        return ""
-
-    def extract_text(self, container):
-        """Extract review text from container"""
-        text_selectors = [
-            'div.text.show-more__control',
-            'div[data-testid="review-summary"]',
-            'div[data-testid="review-text"]',
-            '.review-text',
-            '.content .text',
-            'div.content',
-            '.lister-item-content .text',
-            'div[class*="review-text"]',
-            '.ipc-html-content-inner-div'
-        ]
-        
-        for selector in text_selectors:
-            try:
-                if selector.startswith('.') or selector.startswith('['):
-                    text_elem = container.select_one(selector)
-                else:
-                    text_elem = container.find('div', class_=selector.replace('div.', ''))
-                
-                if text_elem:
-                    text = text_elem.get_text(strip=True)
-                    if text and len(text) > 50:
-                        return text
-            except:
-                continue
-        
-        # Fallback: get all text from container and try to identify review content
-        all_text = container.get_text(strip=True)
-        if len(all_text) > 100:
-            # Try to remove non-review content (ratings, dates, etc.)
-            lines = all_text.split('\n')
-            substantial_lines = [line.strip() for line in lines if len(line.strip()) > 50]
-            if substantial_lines:
-                return ' '.join(substantial_lines)
-        
-        return ""
-
-    def extract_reviews_alternative(self, soup):
-        """Alternative method if structured containers not found"""
-        reviews_data = []
-        
-        # Look for title links and nearby text
-        title_links = soup.find_all('a', href=lambda x: x and 'review' in x)
-        
-        for link in title_links:
-            try:
-                title = link.get_text(strip=True)
-                
-                # Look for review text near the title
-                parent = link.parent
-                for _ in range(3):  # Go up 3 levels to find review container
-                    if parent:
-                        text_divs = parent.find_all('div')
-                        for div in text_divs:
-                            text = div.get_text(strip=True)
-                            if len(text) > 100 and text != title:
-                                reviews_data.append({
-                                    'title': title,
-                                    'text': text
-                                })
-                                break
-                        if reviews_data and reviews_data[-1]['title'] == title:
-                            break
-                        parent = parent.parent
-                    else:
-                        break
-                        
-            except Exception as e:
-                continue
-        
-        return reviews_data
\ No newline at end of file
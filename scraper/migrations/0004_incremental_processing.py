@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0003_alter_prediction_model_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cleaneddata',
+            name='cleaning_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='PipelineCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=50)),
+                ('key', models.CharField(blank=True, max_length=100)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stage', 'key'), name='unique_pipeline_checkpoint')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0005_prediction_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['model_name', 'created_at', 'sentiment'], name='prediction_model_created_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:38
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    # Hash existing reviews. Only the first copy of each (source_url, hash)
+    # keeps its hash; later copies stay NULL so the unique constraint can be
+    # added without deleting rows that cleaned data may already reference.
+    ScrapedData = apps.get_model('scraper', 'ScrapedData')
+    current_url = None
+    seen = set()
+    batch = []
+    for row in ScrapedData.objects.order_by('source_url', 'id').only('id', 'source_url', 'raw_text').iterator(chunk_size=2000):
+        if row.source_url != current_url:
+            current_url = row.source_url
+            seen = set()
+        normalized = ' '.join(row.raw_text.lower().split())
+        digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        row.content_hash = digest
+        batch.append(row)
+        if len(batch) >= 2000:
+            ScrapedData.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        ScrapedData.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0006_prediction_stats_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapeddata',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='scrapeddata',
+            constraint=models.UniqueConstraint(fields=('source_url', 'content_hash'), name='unique_scraped_content'),
+        ),
+    ]
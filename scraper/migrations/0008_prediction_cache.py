@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0007_scrapeddata_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_hash', models.CharField(max_length=64)),
+                ('model_name', models.CharField(max_length=50)),
+                ('model_revision', models.CharField(blank=True, max_length=100)),
+                ('sentiment', models.CharField(max_length=50)),
+                ('score', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model_name', 'model_revision', 'text_hash'), name='unique_prediction_cache')],
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:22
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0008_prediction_cache'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='PipelineCheckpoint',
+        ),
+    ]
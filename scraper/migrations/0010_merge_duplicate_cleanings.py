@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:28
+
+from django.db import migrations
+from django.db.models import Case, Value, When
+
+
+def merge_duplicate_cleanings(apps, schema_editor):
+    # clean_data used to clean every review again on each run, so a review
+    # can have several CleanedData rows for one version. Keep the first one,
+    # move the predictions of the others onto it and delete the copies.
+    CleanedData = apps.get_model('scraper', 'CleanedData')
+    Prediction = apps.get_model('scraper', 'Prediction')
+
+    def merge(keep_for):
+        Prediction.objects.filter(cleaned_id__in=list(keep_for)).update(cleaned_id=Case(
+            *[When(cleaned_id=duplicate, then=Value(keep)) for duplicate, keep in keep_for.items()]))
+        CleanedData.objects.filter(id__in=list(keep_for)).delete()
+
+    current = None
+    keep = None
+    keep_for = {}
+    rows = CleanedData.objects.order_by('scraped_id', 'cleaning_version', 'id').values_list(
+        'id', 'scraped_id', 'cleaning_version')
+    for pk, scraped_id, version in rows.iterator(chunk_size=2000):
+        if (scraped_id, version) != current:
+            current = (scraped_id, version)
+            keep = pk
+            continue
+        keep_for[pk] = keep
+        if len(keep_for) >= 500:
+            merge(keep_for)
+            keep_for = {}
+    if keep_for:
+        merge(keep_for)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0009_delete_pipelinecheckpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cleanings, migrations.RunPython.noop),
+    ]
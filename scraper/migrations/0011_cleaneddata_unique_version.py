@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from 0010: PostgreSQL can't alter a table in the transaction
+    # that deleted rows other tables reference
+
+    dependencies = [
+        ('scraper', '0010_merge_duplicate_cleanings'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='cleaneddata',
+            constraint=models.UniqueConstraint(fields=('scraped', 'cleaning_version'), name='unique_cleaned_version'),
+        ),
+    ]
@@ -1,23 +1,77 @@
+import hashlib
+
 from django.db import models
 
+
+def content_hash(text):
+    """SHA-256 of review text with case and whitespace normalized"""
+    normalized = ' '.join(text.lower().split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
 class ScrapedData(models.Model):
     source_url = models.URLField()
     review_title = models.CharField(max_length=255, blank=True)
     raw_text = models.TextField()
+    # NULL only for duplicates that existed before hashing was introduced
+    content_hash = models.CharField(max_length=64, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source_url', 'content_hash'], name='unique_scraped_content'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Hash on insert only: re-saving a legacy duplicate must keep its NULL
+        # hash, or it would collide with the copy that holds the hash
+        if self._state.adding and self.content_hash is None:
+            self.content_hash = content_hash(self.raw_text)
+        super().save(*args, **kwargs)
+
 class CleanedData(models.Model):
     scraped = models.ForeignKey(ScrapedData, on_delete=models.CASCADE)
     cleaned_text = models.TextField()
+    cleaning_version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One cleaning per review and version, even under concurrent requests
+            models.UniqueConstraint(fields=['scraped', 'cleaning_version'], name='unique_cleaned_version'),
+        ]
+
 class Prediction(models.Model):
     cleaned = models.ForeignKey(CleanedData, on_delete=models.CASCADE)
     sentiment = models.CharField(max_length=50)
     model_name = models.CharField(max_length=50, default='bert-base-uncased')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination in /api/predictions/
+            models.Index(fields=['created_at', 'id'], name='prediction_created_id_idx'),
+            # Filtered sentiment counts in /api/predictions/stats/
+            models.Index(fields=['model_name', 'created_at', 'sentiment'],
+                         name='prediction_model_created_idx'),
+        ]
+
 class InferenceLog(models.Model):
     question = models.TextField()
     answer = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+class PredictionCache(models.Model):
+    """Model output for a cleaned text, reused instead of running inference again"""
+    text_hash = models.CharField(max_length=64)
+    model_name = models.CharField(max_length=50)
+    model_revision = models.CharField(max_length=100, blank=True)
+    sentiment = models.CharField(max_length=50)
+    score = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model_name', 'model_revision', 'text_hash'],
+                                    name='unique_prediction_cache'),
+        ]
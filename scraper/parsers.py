@@ -0,0 +1,363 @@
+"""
+HTML extraction backends for IMDB review pages.
+
+``SoupBackend`` is the original BeautifulSoup extraction. ``LxmlBackend``
+produces the same review dicts from an lxml tree, with every selector
+compiled to an XPath expression once at import time. Both expose
+``extract_page(html) -> (reviews, pagination_key)``; see the benchmark_parsers
+command for a speed and parity comparison on saved pages.
+"""
+import threading
+
+from django.conf import settings
+
+
+class SoupBackend:
+    """BeautifulSoup + html.parser, trying each selector in turn"""
+
+    name = 'soup'
+
+    def extract_page(self, html):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, 'html.parser')
+        return self.extract_reviews(soup), self.pagination_key(soup)
+
+    def pagination_key(self, soup):
+        """The key for the next "load more" page, or None on the last page"""
+        load_more = soup.find('div', class_='load-more-data')
+        if load_more is None:
+            return None
+        return load_more.get('data-key') or None
+
+    def extract_reviews(self, soup):
+        """Extract reviews with separate title and text"""
+        reviews_data = []
+        
+        # Method 1: Try modern IMDB structure
+        review_containers = soup.find_all('div', {'data-testid': 'review-card'})
+        if not review_containers:
+            review_containers = soup.find_all('div', class_='review-container')
+        if not review_containers:
+            review_containers = soup.find_all('div', class_='lister-item')
+        
+        for container in review_containers:
+            try:
+                # Extract title - try multiple selectors
+                title = self.extract_title(container)
+                
+                # Extract review text - try multiple selectors
+                text = self.extract_text(container)
+                
+                if title or text:
+                    reviews_data.append({
+                        'title': title,
+                        'text': text
+                    })
+                    
+            except Exception as e:
+                print(f"Error extracting from container: {e}")
+                continue
+        
+        # Method 2: If no structured containers found, try alternative approach
+        if not reviews_data:
+            reviews_data = self.extract_reviews_alternative(soup)
+        
+        return reviews_data
+
+    def extract_title(self, container):
+        """Extract review title from container"""
+        title_selectors = [
+            'a.title',
+            'h3 a',
+            'div[data-testid="review-title"]',
+            '.review-title',
+            '.titleReviewBarItem .titleReviewBarSubItem .title',
+            'a[href*="review"]',
+            '.ipc-title__text',
+            'h4 a'
+        ]
+        
+        for selector in title_selectors:
+            try:
+                if selector.startswith('.') or selector.startswith('['):
+                    title_elem = container.select_one(selector)
+                else:
+                    title_elem = container.find(selector.split()[0], class_=selector.split('.')[1] if '.' in selector else None)
+                
+                if title_elem:
+                    title = title_elem.get_text(strip=True)
+                    if title and len(title) > 5:
+                        return title
+            except:
+                continue
+        
+        return ""
+
+    def extract_text(self, container):
+        """Extract review text from container"""
+        text_selectors = [
+            'div.text.show-more__control',
+            'div[data-testid="review-summary"]',
+            'div[data-testid="review-text"]',
+            '.review-text',
+            '.content .text',
+            'div.content',
+            '.lister-item-content .text',
+            'div[class*="review-text"]',
+            '.ipc-html-content-inner-div'
+        ]
+        
+        for selector in text_selectors:
+            try:
+                if selector.startswith('.') or selector.startswith('['):
+                    text_elem = container.select_one(selector)
+                else:
+                    text_elem = container.find('div', class_=selector.replace('div.', ''))
+                
+                if text_elem:
+                    text = text_elem.get_text(strip=True)
+                    if text and len(text) > 50:
+                        return text
+            except:
+                continue
+        
+        # Fallback: get all text from container and try to identify review content
+        all_text = container.get_text(strip=True)
+        if len(all_text) > 100:
+            # Try to remove non-review content (ratings, dates, etc.)
+            lines = all_text.split('\n')
+            substantial_lines = [line.strip() for line in lines if len(line.strip()) > 50]
+            if substantial_lines:
+                return ' '.join(substantial_lines)
+        
+        return ""
+
+    def extract_reviews_alternative(self, soup):
+        """Alternative method if structured containers not found"""
+        reviews_data = []
+        
+        # Look for title links and nearby text
+        title_links = soup.find_all('a', href=lambda x: x and 'review' in x)
+        
+        for link in title_links:
+            try:
+                title = link.get_text(strip=True)
+                
+                # Look for review text near the title
+                parent = link.parent
+                for _ in range(3):  # Go up 3 levels to find review container
+                    if parent:
+                        text_divs = parent.find_all('div')
+                        for div in text_divs:
+                            text = div.get_text(strip=True)
+                            if len(text) > 100 and text != title:
+                                reviews_data.append({
+                                    'title': title,
+                                    'text': text
+                                })
+                                break
+                        if reviews_data and reviews_data[-1]['title'] == title:
+                            break
+                        parent = parent.parent
+                    else:
+                        break
+                        
+            except Exception as e:
+                continue
+        
+        return reviews_data
+
+
+def _has_class(name):
+    # Matches one whitespace-separated token of @class, like BeautifulSoup's class_
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _compile(expressions):
+    from lxml import etree
+
+    return [etree.XPath(expression) for expression in expressions]
+
+
+def _compile_rules(steps):
+    """One union over a container's subtree, plus a self-test per rule"""
+    from lxml import etree
+
+    union = etree.XPath(' | '.join(f'.//{step}' for step in steps))
+    return union, [etree.XPath(f'self::{step}') for step in steps]
+
+
+# Each list mirrors, in order, how SoupBackend resolves its selectors: plain
+# ``find(tag, class_=...)`` lookups for tag-prefixed selectors and CSS
+# ``select_one`` for the rest, so both backends pick the same element.
+CONTAINER_XPATHS = [
+    "//div[@data-testid='review-card']",
+    f"//div[{_has_class('review-container')}]",
+    f"//div[{_has_class('lister-item')}]",
+]
+
+# Title and text rules are location steps below the container. They are
+# looked up in one pass (see LxmlBackend.first_text), then tried in order.
+# 'a.title', 'div[data-testid="review-title"]' and 'a[href*="review"]' are
+# looked up as tag names by SoupBackend.extract_title and never match, so
+# they have no rule here.
+TITLE_STEPS = [
+    "h3",                                                   # 'h3 a'
+    f"*[{_has_class('review-title')}]",                     # '.review-title'
+    f"*[{_has_class('title')}]"
+    f"[ancestor::*[{_has_class('titleReviewBarSubItem')}]"
+    f"[ancestor::*[{_has_class('titleReviewBarItem')}]]]",  # '.titleReviewBarItem .titleReviewBarSubItem .title'
+    f"*[{_has_class('ipc-title__text')}]",                  # '.ipc-title__text'
+    "h4",                                                   # 'h4 a'
+]
+
+# Likewise, SoupBackend.extract_text looks up 'div.text.show-more__control',
+# 'div[data-testid="review-summary"]', 'div[data-testid="review-text"]' and
+# 'div[class*="review-text"]' as a single class name containing dots or
+# brackets, which never matches, so they have no rule here.
+TEXT_STEPS = [
+    f"*[{_has_class('review-text')}]",                      # '.review-text'
+    f"*[{_has_class('text')}][ancestor::*[{_has_class('content')}]]",  # '.content .text'
+    f"div[{_has_class('content')}]",                        # 'div.content'
+    f"*[{_has_class('text')}]"
+    f"[ancestor::*[{_has_class('lister-item-content')}]]",  # '.lister-item-content .text'
+    f"*[{_has_class('ipc-html-content-inner-div')}]",       # '.ipc-html-content-inner-div'
+]
+
+# Text nodes BeautifulSoup's get_text() returns: not comments, and nothing
+# inside script, style, template or ruby annotations
+TEXT_NODES_XPATH = (
+    ".//text()[not(ancestor::script or ancestor::style or ancestor::template"
+    " or ancestor::rt or ancestor::rp)]"
+)
+
+
+class LxmlBackend:
+    """lxml with selectors precompiled to XPath"""
+
+    name = 'lxml'
+
+    def __init__(self):
+        # Compiled XPath objects are kept per thread so one backend can be
+        # shared by the fetcher's parsing threads and the browser workers
+        self._local = threading.local()
+        self._compile_for_thread()
+
+    def _compile_for_thread(self):
+        from lxml import etree
+
+        local = self._local
+        local.containers = _compile(CONTAINER_XPATHS)
+        local.titles = _compile_rules(TITLE_STEPS)
+        local.texts = _compile_rules(TEXT_STEPS)
+        local.text_nodes = etree.XPath(TEXT_NODES_XPATH)
+        local.review_links = etree.XPath("//a[contains(@href, 'review')]")
+        local.descendant_divs = etree.XPath(".//div")
+        local.load_more = etree.XPath(f"//div[{_has_class('load-more-data')}]/@data-key")
+        return local
+
+    @property
+    def xpaths(self):
+        local = self._local
+        if not hasattr(local, 'containers'):
+            local = self._compile_for_thread()
+        return local
+
+    def get_text(self, element):
+        """Equivalent of BeautifulSoup's ``get_text(strip=True)``"""
+        return ''.join(s.strip() for s in self.xpaths.text_nodes(element) if s.strip())
+
+    def extract_page(self, html):
+        import lxml.html
+
+        if not html.strip():
+            return [], None
+        root = lxml.html.document_fromstring(html)
+        return self.extract_reviews(root), self.pagination_key(root)
+
+    def pagination_key(self, root):
+        keys = self.xpaths.load_more(root)
+        return keys[0] or None if keys else None
+
+    def extract_reviews(self, root):
+        reviews_data = []
+        review_containers = []
+        for xpath in self.xpaths.containers:
+            review_containers = xpath(root)
+            if review_containers:
+                break
+
+        for container in review_containers:
+            title = self.first_text(container, self.xpaths.titles, 5)
+            text = self.extract_text(container)
+            if title or text:
+                reviews_data.append({'title': title, 'text': text})
+
+        if not reviews_data:
+            reviews_data = self.extract_reviews_alternative(root)
+        return reviews_data
+
+    def first_text(self, container, rules, min_length):
+        """Text of the first matching element per rule, in rule order"""
+        # One walk of the container finds every candidate (in document
+        # order); each rule then only tests those few elements
+        union, tests = rules
+        candidates = union(container)
+        if not candidates:
+            return ""
+        for test in tests:
+            for element in candidates:
+                if test(element):
+                    text = self.get_text(element)
+                    if text and len(text) > min_length:
+                        return text
+                    break
+        return ""
+
+    def extract_text(self, container):
+        text = self.first_text(container, self.xpaths.texts, 50)
+        if text:
+            return text
+
+        # Same fallback as SoupBackend.extract_text
+        all_text = self.get_text(container)
+        if len(all_text) > 100:
+            lines = all_text.split('\n')
+            substantial_lines = [line.strip() for line in lines if len(line.strip()) > 50]
+            if substantial_lines:
+                return ' '.join(substantial_lines)
+        return ""
+
+    def extract_reviews_alternative(self, root):
+        reviews_data = []
+        for link in self.xpaths.review_links(root):
+            title = self.get_text(link)
+            parent = link.getparent()
+            for _ in range(3):  # Go up 3 levels to find review container
+                if parent is None:
+                    break
+                for div in self.xpaths.descendant_divs(parent):
+                    text = self.get_text(div)
+                    if len(text) > 100 and text != title:
+                        reviews_data.append({'title': title, 'text': text})
+                        break
+                if reviews_data and reviews_data[-1]['title'] == title:
+                    break
+                parent = parent.getparent()
+        return reviews_data
+
+
+BACKENDS = {
+    SoupBackend.name: SoupBackend,
+    LxmlBackend.name: LxmlBackend,
+}
+
+
+def get_backend(name=None):
+    """Return a new extraction backend (default: SCRAPER_PARSER_BACKEND)"""
+    name = name or settings.SCRAPER_PARSER_BACKEND
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise LookupError(f'Unknown parser backend: {name}')
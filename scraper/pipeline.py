@@ -0,0 +1,248 @@
+"""
+Streaming scrape -> clean -> predict pipeline used by run_pipeline.
+
+Each stage is a set of worker threads that consume batches from a bounded
+queue and write their output to the database in one bulk insert per batch
+before handing it to the next stage. A full queue blocks the stage upstream
+of it, so a slow model slows the scraper down instead of letting memory
+grow. Every record carries the time it was ingested, which gives
+end-to-end latency per review.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from ml_model.scheduling import LengthBucketScheduler
+from preprocessing.normalizer import get_normalizer
+from preprocessing.workers import clean_chunk, init_worker
+from scraper.ingest import ingest_reviews
+from scraper.models import CleanedData, Prediction, ScrapedData
+
+
+_STOP = object()
+
+
+class StageStats:
+    """Throughput counters for one stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.batches += 1
+            self.busy_seconds += seconds
+
+    def rate(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.items / elapsed if elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"{self.name:>8}: {self.items} items in {self.batches} batches, "
+            f"{self.rate():.1f} items/s, busy {self.busy_seconds:.1f}s, {self.errors} errors"
+        )
+
+
+class Stage:
+    """
+    Worker threads that turn batches of records from ``inbox`` into batches
+    for ``outbox``.
+
+    Incoming lists are merged until ``batch_size`` records are collected or
+    ``max_wait`` seconds have passed since the first one arrived.
+    """
+
+    def __init__(self, name, handler, workers, inbox, outbox=None,
+                 batch_size=1, max_wait=0.0, on_error=None):
+        self.handler = handler
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.on_error = on_error
+        self.stats = StageStats(name)
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f'{self.stats.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Signal end of input and wait for in-flight batches to finish"""
+        for _ in self._threads:
+            self.inbox.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self.stats.finished = time.monotonic()
+
+    def _next_batch(self):
+        """Collect the next batch, or return (batch, True) on end of input"""
+        item = self.inbox.get()
+        if item is _STOP:
+            return [], True
+        batch = list(item)
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.extend(item)
+        return batch, False
+
+    def _run(self):
+        try:
+            done = False
+            while not done:
+                batch, done = self._next_batch()
+                if not batch:
+                    continue
+                started = time.monotonic()
+                try:
+                    output = self.handler(batch)
+                except Exception as e:
+                    self.stats.errors += 1
+                    if self.on_error:
+                        self.on_error(self.stats.name, e)
+                    continue
+                self.stats.record(len(batch), time.monotonic() - started)
+                if self.outbox is not None and output:
+                    self.outbox.put(output)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+
+class Pipeline:
+    """Scrapes titles and cleans and classifies each review as it arrives"""
+
+    def __init__(self, fetcher, classifier, model_name, clean_workers=1,
+                 predict_workers=1, batch_size=32, queue_size=8,
+                 flush_interval=0.5, on_error=None):
+        self.fetcher = fetcher
+        self.classifier = classifier
+        self.scheduler = LengthBucketScheduler(classifier, batch_size=batch_size)
+        self.model_name = model_name
+        self.clean_workers = clean_workers
+        self.cleaning_version = settings.CLEANING_VERSION
+        self.latencies = []
+        self._latency_lock = threading.Lock()
+        self._pool = None
+
+        self.clean_queue = queue.Queue(maxsize=queue_size)
+        self.predict_queue = queue.Queue(maxsize=queue_size)
+        self.scrape_stats = StageStats('scrape')
+        self.clean_stage = Stage(
+            'clean', self.clean, clean_workers, self.clean_queue, self.predict_queue,
+            on_error=on_error)
+        self.predict_stage = Stage(
+            'predict', self.predict, predict_workers, self.predict_queue,
+            batch_size=batch_size, max_wait=flush_interval, on_error=on_error)
+        self.on_error = on_error
+
+    @property
+    def stats(self):
+        return [self.scrape_stats, self.clean_stage.stats, self.predict_stage.stats]
+
+    def run(self, title_ids):
+        if self.clean_workers > 1:
+            # Cleaning is CPU-bound; each clean thread drives one worker process
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.clean_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(settings.NORMALIZER_LEMMA_CACHE_SIZE,))
+        try:
+            self.predict_stage.start()
+            self.clean_stage.start()
+            self.scrape(title_ids)
+            self.scrape_stats.finished = time.monotonic()
+            self.clean_stage.stop()
+            self.predict_stage.stop()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+
+    def scrape(self, title_ids):
+        """Fetch titles concurrently and queue each title's new reviews"""
+        for title_id, url, result in self.fetcher.iter_results(title_ids):
+            close_old_connections()
+            if isinstance(result, Exception):
+                self.scrape_stats.errors += 1
+                if self.on_error:
+                    self.on_error('scrape', result)
+                continue
+
+            started = time.monotonic()
+            reviews = [
+                {'title': r.get('title', '').strip(), 'text': r.get('text', '').strip()}
+                for r in result
+            ]
+            # Only save if there's substantial text, as scrape_imdb does
+            reviews = [r for r in reviews if r['text'] and len(r['text']) > 50]
+            new_rows = ingest_reviews(url, reviews)
+            # bulk_create skips conflicts, so read back the ids of the new rows
+            rows = list(
+                ScrapedData.objects.filter(
+                    source_url=url,
+                    content_hash__in=[row.content_hash for row in new_rows],
+                ).values_list('id', 'raw_text')
+            )
+            self.scrape_stats.record(len(rows), time.monotonic() - started)
+            if rows:
+                ingested = time.monotonic()
+                self.clean_queue.put([(pk, text, ingested) for pk, text in rows])
+
+    def clean(self, batch):
+        """Normalize a batch of (scraped_id, raw_text, ingested) records"""
+        pairs = [(pk, text) for pk, text, _ in batch]
+        if self._pool is not None:
+            cleaned_pairs = self._pool.submit(clean_chunk, pairs).result()
+        else:
+            normalize = get_normalizer().normalize
+            cleaned_pairs = [(pk, normalize(text)) for pk, text in pairs]
+
+        cleaned_rows = CleanedData.objects.bulk_create([
+            CleanedData(scraped_id=pk, cleaned_text=text, cleaning_version=self.cleaning_version)
+            for pk, text in cleaned_pairs
+        ])
+        return [
+            (row.id, row.cleaned_text, ingested)
+            for row, (_, _, ingested) in zip(cleaned_rows, batch)
+        ]
+
+    def predict(self, batch):
+        """Classify a batch of (cleaned_id, cleaned_text, ingested) records"""
+        # Truncated by token count and padded per length bucket
+        results = self.scheduler([text for _, text, _ in batch])
+        Prediction.objects.bulk_create([
+            Prediction(cleaned_id=pk, sentiment=result['label'], model_name=self.model_name)
+            for (pk, _, _), result in zip(batch, results)
+        ])
+
+        finished = time.monotonic()
+        with self._latency_lock:
+            self.latencies.extend(finished - ingested for _, _, ingested in batch)
@@ -1,3 +1,195 @@
-from django.test import TestCase
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from .fetcher import ReviewFetcher
+from .ingest import ingest_reviews
+from .models import ScrapedData, content_hash
+from .parsers import get_backend
+
+
+def review_page(title_id, page, pages):
+    """An IMDB "load more" fragment with two legacy review cards"""
+    cards = ''.join(
+        f'<div class="lister-item"><h3><a href="/review/rw{page}{i}/">{title_id} title {page}-{i}</a></h3>'
+        f'<div class="content"><div class="text">{title_id} review {page}-{i}, '
+        f'long enough to count as the text of a review.</div></div></div>'
+        for i in range(2)
+    )
+    more = f'<div class="load-more-data" data-key="k{page + 1}"></div>' if page + 1 < pages else ''
+    return f'<div class="lister-list">{cards}</div>{more}'
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves review pages, after any failures queued for the title"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        title_id = url.path.split('/')[2]
+        page = int(parse_qs(url.query).get('paginationKey', ['k0'])[0][1:])
+        server = self.server
+        with server.lock:
+            server.requests.append((title_id, page, self.client_address))
+            failures = server.failures.get(title_id)
+            status = failures.pop(0) if failures else 200
+        time.sleep(server.delay)
+
+        body = (review_page(title_id, page, server.pages) if status == 200 else 'error').encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class ReviewFetcherTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests = []
+        self.server.failures = {}
+        self.server.delay = 0
+        self.server.pages = 3
+
+    def fetch(self, title_ids, **kwargs):
+        fetcher = ReviewFetcher(
+            get_backend('soup'), base_url=f'http://127.0.0.1:{self.server.server_port}',
+            rate=0, backoff=0.01, **kwargs)
+        return {title_id: result for title_id, _, result in fetcher.iter_results(title_ids)}
+
+    def test_follows_load_more_keys_and_parses_every_page(self):
+        reviews = self.fetch(['tt1'])['tt1']
+
+        self.assertEqual(
+            [review['title'] for review in reviews],
+            [f'tt1 title {page}-{i}' for page in range(3) for i in range(2)])
+        self.assertTrue(reviews[0]['text'].startswith('tt1 review 0-0, long enough'))
+        self.assertEqual([page for _, page, _ in self.server.requests], [0, 1, 2])
+
+    def test_pages_reuse_one_pooled_connection(self):
+        self.fetch(['tt1', 'tt2'], concurrency=1)
+
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(len({address for _, _, address in self.server.requests}), 1)
+
+    def test_rate_limits_and_server_errors_are_retried(self):
+        self.server.pages = 1
+        self.server.failures = {'tt1': [503, 429, 500]}
+
+        reviews = self.fetch(['tt1'], max_retries=3)['tt1']
+        self.assertEqual(len(reviews), 2)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_retries_are_bounded_and_backed_off(self):
+        import httpx
+
+        self.server.pages = 1
+        self.server.failures = {'tt1': [503] * 5}
+        started = time.monotonic()
+
+        result = self.fetch(['tt1'], max_retries=2)['tt1']
+        self.assertIsInstance(result, httpx.HTTPStatusError)
+        self.assertEqual(len(self.server.requests), 3)
+        # 0.01 s, then 0.02 s
+        self.assertGreaterEqual(time.monotonic() - started, 0.03)
+
+    def test_client_errors_are_not_retried(self):
+        import httpx
+
+        self.server.failures = {'tt1': [404]}
+
+        self.assertIsInstance(self.fetch(['tt1'])['tt1'], httpx.HTTPStatusError)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_stalled_pages_time_out(self):
+        import httpx
+
+        self.server.delay = 0.5
+        started = time.monotonic()
+
+        result = self.fetch(['tt1'], timeout=0.1, max_retries=1)['tt1']
+        self.assertIsInstance(result, httpx.TimeoutException)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+class IngestReviewsTests(TestCase):
+    url = 'https://www.imdb.com/title/tt1/reviews'
+    review = {'title': 'Great', 'text': 'A great film with a great cast.'}
+
+    def test_reingesting_a_review_inserts_nothing(self):
+        self.assertEqual(len(ingest_reviews(self.url, [self.review])), 1)
+        self.assertEqual(ingest_reviews(self.url, [self.review]), [])
+        self.assertEqual(ScrapedData.objects.count(), 1)
+
+    def test_whitespace_and_case_differences_are_duplicates(self):
+        ingest_reviews(self.url, [self.review])
+        variants = [
+            {'title': 'Great', 'text': '  a GREAT film\nwith a   great cast. '},
+            {'title': 'Other title', 'text': 'A Great Film With A Great Cast.'},
+        ]
+        self.assertEqual(ingest_reviews(self.url, variants), [])
+        self.assertEqual(ScrapedData.objects.count(), 1)
+
+    def test_duplicates_within_one_page_are_saved_once(self):
+        saved = ingest_reviews(self.url, [self.review, dict(self.review, text=self.review['text'].upper())])
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(ScrapedData.objects.count(), 1)
+
+    def test_same_text_on_another_page_is_kept(self):
+        ingest_reviews(self.url, [self.review])
+        ingest_reviews('https://www.imdb.com/title/tt2/reviews', [self.review])
+        self.assertEqual(ScrapedData.objects.count(), 2)
+
+    def test_conflicts_missed_by_the_lookup_are_ignored(self):
+        ingest_reviews(self.url, [self.review])
+        # As if a concurrent scrape committed the row after our lookup
+        with mock.patch.object(ScrapedData.objects, 'filter', return_value=ScrapedData.objects.none()):
+            ingest_reviews(self.url, [self.review])
+        self.assertEqual(ScrapedData.objects.count(), 1)
+
+
+class ScrapedDataTests(TestCase):
+    url = 'https://www.imdb.com/title/tt1/reviews'
+
+    def test_new_rows_are_hashed(self):
+        scraped = ScrapedData.objects.create(source_url=self.url, raw_text='A  GREAT film')
+        self.assertEqual(scraped.content_hash, content_hash('a great film'))
+
+    def test_resaving_a_legacy_duplicate_keeps_its_null_hash(self):
+        ScrapedData.objects.create(source_url=self.url, raw_text='A great film')
+        # Saved before hashing existed, so the backfill left it unhashed
+        [duplicate] = ScrapedData.objects.bulk_create([ScrapedData(source_url=self.url, raw_text='A great film')])
+
+        duplicate.review_title = 'Great'
+        duplicate.save()
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.review_title, 'Great')
+        self.assertIsNone(duplicate.content_hash)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smart_text_pipeline.settings')
+# Load the sentiment models once per worker before serving requests
+os.environ.setdefault('SENTIMENT_WARMUP', '1')
 
 application = get_asgi_application()
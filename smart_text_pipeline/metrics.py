@@ -0,0 +1,212 @@
+"""
+Lightweight in-process metrics: counters, histograms and stage timers.
+
+Everything is kept in memory per process and rendered in the Prometheus text
+format by ``/api/metrics/``. Components that already keep their own
+statistics (caches, the micro-batcher) register a collector that is read at
+scrape time instead of updating metrics on every call. Management commands
+run in their own process and can write the same text to a file for the
+node_exporter textfile collector.
+
+``timer(stage)`` also adds the stage to the ``Server-Timing`` header of the
+current request when ``METRICS_SERVER_TIMING`` is on.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_metrics = []
+_collectors = []
+_server_timing = contextvars.ContextVar('server_timing', default=None)
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in labels
+    )
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative buckets, sum and count per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    samples.append((f'{self.name}_bucket', key + (('le', bound),), count))
+                samples.append((f'{self.name}_bucket', key + (('le', '+Inf'),), state[-1]))
+                samples.append((f'{self.name}_sum', key, state[-2]))
+                samples.append((f'{self.name}_count', key, state[-1]))
+        return samples
+
+
+STAGE_SECONDS = Histogram(
+    'stp_stage_seconds', 'Time spent in each processing stage', labels=('stage',))
+BATCH_SIZE = Histogram(
+    'stp_batch_size', 'Items per batch handed to a stage', labels=('stage',), buckets=SIZE_BUCKETS)
+ROWS_PER_SECOND = Histogram(
+    'stp_rows_per_second', 'Throughput of each batch', labels=('stage',), buckets=RATE_BUCKETS)
+ROWS = Counter('stp_rows_total', 'Rows processed per stage', labels=('stage',))
+CACHE_REQUESTS = Counter(
+    'stp_cache_requests_total', 'Cache lookups by result', labels=('cache', 'result'))
+HTTP_SECONDS = Histogram(
+    'stp_http_request_seconds', 'Request latency by view', labels=('view', 'method'))
+
+
+def register_collector(collect):
+    """``collect()`` returns ``(name, kind, help, labels_dict, value)`` tuples at scrape time"""
+    _collectors.append(collect)
+
+
+@contextmanager
+def timer(stage):
+    """Time a block into stp_stage_seconds and the Server-Timing header"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _server_timing.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def record_batch(stage, size, seconds):
+    """Batch size, row count and throughput of one processed batch"""
+    BATCH_SIZE.observe(size, stage=stage)
+    ROWS.inc(size, stage=stage)
+    if seconds > 0:
+        ROWS_PER_SECOND.observe(size / seconds, stage=stage)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    families = {}
+    for metric in _metrics:
+        families[metric.name] = (metric.kind, metric.help, metric.samples())
+    for collect in _collectors:
+        for name, kind, help_text, labels, value in collect():
+            family = families.setdefault(name, (kind, help_text, []))
+            family[2].append((name, tuple(sorted(labels.items())), value))
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample_name, labels, value in samples:
+            lines.append(f'{sample_name}{_label_text(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    """Write the current metrics for the node_exporter textfile collector"""
+    with open(path, 'w') as f:
+        f.write(render())
+
+
+class ServerTimingMiddleware:
+    """Times each request and reports its stages in a Server-Timing header"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return match.view_name if match else 'unmatched'
+
+    def _finish(self, request, response, timings, started):
+        elapsed = time.perf_counter() - started
+        HTTP_SECONDS.observe(elapsed, view=self._view_name(request), method=request.method)
+        if settings.METRICS_SERVER_TIMING:
+            entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings]
+            entries.append(f'total;dur={elapsed * 1000:.1f}')
+            response['Server-Timing'] = ', '.join(entries)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = []
+        token = _server_timing.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _server_timing.reset(token)
+        return self._finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = []
+        token = _server_timing.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _server_timing.reset(token)
+        return self._finish(request, response, timings, started)
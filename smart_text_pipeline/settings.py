@@ -42,9 +42,13 @@ INSTALLED_APPS = [
     'preprocessing',
     'ml_model',
     'api',
+    # Project-wide benchmarks and checks that span every app
+    'ops',
 ]
 
 MIDDLEWARE = [
+    # Outermost, so request timings include every other middleware
+    'smart_text_pipeline.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +92,13 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite runs against a local SQLite file instead (e.g. for benchmarks)
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,3 +140,126 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Sentiment models
+# Keys are the values stored in Prediction.model_name. A 'model' of None keeps
+# the transformers default checkpoint for the task. 'backend': 'onnx' serves
+# the checkpoint through ONNX Runtime, int8-quantized for the CPU instruction
+# set named by 'quantization' (an optimum AutoQuantizationConfig method, or
+# None for plain fp32 ONNX); check it with `manage.py check_model_parity`.
+# 'revision' pins the checkpoint version and is part of the prediction cache
+# key, so bumping it invalidates cached outputs.
+
+SENTIMENT_MODELS = {
+    'bert-base-uncased': {
+        'task': 'sentiment-analysis',
+        'model': None,
+    },
+    'bert-base-uncased-onnx-int8': {
+        'task': 'sentiment-analysis',
+        # The checkpoint the default pipeline above resolves to
+        'model': 'distilbert/distilbert-base-uncased-finetuned-sst-2-english',
+        'backend': 'onnx',
+        'quantization': 'avx2',
+    },
+}
+
+SENTIMENT_DEFAULT_MODEL = os.getenv('SENTIMENT_DEFAULT_MODEL', 'bert-base-uncased')
+
+# Where ONNX exports are written on first use
+SENTIMENT_ONNX_DIR = os.getenv('SENTIMENT_ONNX_DIR', str(BASE_DIR / 'onnx_models'))
+
+# Reviews longer than the model's token limit are truncated, or with the
+# sliding window split into windows overlapping by this many tokens whose
+# scores are averaged
+SENTIMENT_SLIDING_WINDOW = os.getenv('SENTIMENT_SLIDING_WINDOW', '0') == '1'
+SENTIMENT_WINDOW_OVERLAP = int(os.getenv('SENTIMENT_WINDOW_OVERLAP', '64'))
+
+# Load the default model when the app registry is ready
+SENTIMENT_WARMUP = os.getenv('SENTIMENT_WARMUP', '0') == '1'
+
+# CPU threads used by torch; 0 keeps the torch default
+SENTIMENT_NUM_THREADS = int(os.getenv('SENTIMENT_NUM_THREADS', '0'))
+SENTIMENT_INTEROP_THREADS = int(os.getenv('SENTIMENT_INTEROP_THREADS', '0'))
+
+# Bump when the cleaning rules change so clean_data re-cleans every review
+CLEANING_VERSION = 1
+
+# Distinct tokens whose lemma is cached by the text normalizer
+NORMALIZER_LEMMA_CACHE_SIZE = int(os.getenv('NORMALIZER_LEMMA_CACHE_SIZE', '100000'))
+
+# /api/predictions/ page sizes
+PREDICTIONS_PAGE_SIZE = 100
+PREDICTIONS_MAX_PAGE_SIZE = 1000
+
+# Reviews included in the /api/ask/ prompt: at most ASK_CONTEXT_TOP_K of the
+# most relevant ones, within roughly ASK_CONTEXT_TOKEN_BUDGET tokens
+ASK_CONTEXT_TOP_K = int(os.getenv('ASK_CONTEXT_TOP_K', '50'))
+ASK_CONTEXT_TOKEN_BUDGET = int(os.getenv('ASK_CONTEXT_TOKEN_BUDGET', '2000'))
+
+# Gemini (used by /api/ask/). GEMINI_API_BASE can point at a local stub server.
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+GEMINI_CONNECT_TIMEOUT = float(os.getenv('GEMINI_CONNECT_TIMEOUT', '5'))
+GEMINI_READ_TIMEOUT = float(os.getenv('GEMINI_READ_TIMEOUT', '60'))
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '2'))
+GEMINI_POOL_SIZE = int(os.getenv('GEMINI_POOL_SIZE', '10'))
+
+# Concurrent Gemini calls per worker from /api/ask/async/; further questions wait
+GEMINI_MAX_IN_FLIGHT = int(os.getenv('GEMINI_MAX_IN_FLIGHT', '100'))
+
+# Seconds a cached /api/ask/ answer stays valid
+ASK_CACHE_TTL = int(os.getenv('ASK_CACHE_TTL', '600'))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The 'answers' cache evicts least recently used entries beyond MAX_ENTRIES.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'answers': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ask-answers',
+        'TIMEOUT': ASK_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('ASK_CACHE_MAX_ENTRIES', '1000')),
+        },
+    },
+}
+
+# Base URL for IMDB review pages; point it at a local fixture server to test
+IMDB_BASE_URL = os.getenv('IMDB_BASE_URL', 'https://www.imdb.com')
+
+# HTML extraction backend for scraped pages: 'soup' or 'lxml'
+SCRAPER_PARSER_BACKEND = os.getenv('SCRAPER_PARSER_BACKEND', 'soup')
+
+# Micro-batching for /api/predict/: requests arriving within the window of
+# the first queued one share a model call, up to the max batch size
+INFERENCE_BATCH_WAIT_MS = float(os.getenv('INFERENCE_BATCH_WAIT_MS', '5'))
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '32'))
+
+# Largest number of texts accepted by /api/predict/batch/
+PREDICT_BATCH_MAX_TEXTS = int(os.getenv('PREDICT_BATCH_MAX_TEXTS', '1000'))
+
+# Model outputs kept in each process's LRU in front of the PredictionCache table
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '100000'))
+
+# Add a Server-Timing header with per-stage durations to every response
+METRICS_SERVER_TIMING = os.getenv('METRICS_SERVER_TIMING', '0') == '1'
+
+# BM25 index behind /api/ask/ context: seconds between background refreshes,
+# postings scored per query term, and the share of reviews above which a
+# term is too common to score
+ASK_INDEX_REFRESH_SECONDS = float(os.getenv('ASK_INDEX_REFRESH_SECONDS', '5'))
+ASK_INDEX_MAX_POSTINGS = int(os.getenv('ASK_INDEX_MAX_POSTINGS', '5000'))
+ASK_INDEX_MAX_DF = float(os.getenv('ASK_INDEX_MAX_DF', '0.5'))
+
+# Rows can commit out of id order: each refresh also re-checks this many ids
+# below the highest indexed one, and every ASK_INDEX_RECONCILE_SECONDS all of them
+ASK_INDEX_LOOKBACK = int(os.getenv('ASK_INDEX_LOOKBACK', '10000'))
+ASK_INDEX_RECONCILE_SECONDS = float(os.getenv('ASK_INDEX_RECONCILE_SECONDS', '600'))
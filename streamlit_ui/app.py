@@ -1,4 +1,6 @@
 import streamlit as st
+import io
+import json
 import requests
 import os
 import matplotlib.pyplot as plt
@@ -7,21 +9,65 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_BASE = "http://127.0.0.1:8000/api"
+# Seconds API responses are reused across reruns of this script
+CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+# Streaming ask endpoint: /ask/ streams under WSGI (runserver, gunicorn), but
+# an ASGI server buffers its sync stream, so use /ask/async/ there (uvicorn)
+ASK_PATH = os.getenv("DASHBOARD_ASK_PATH", "/ask/")
+PAGE_SIZE = 20
 
 st.title("📚 Smart Text Insight Pipeline")
 
 st.header("Stored Predictions")
 
-res = requests.get(f"{API_BASE}/predictions/")
-if res.status_code == 200:
-    for item in res.json():
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_page(cursor, page_size, fields):
+    """One page of /api/predictions/, or None on error"""
+    params = {"page_size": page_size, "fields": fields}
+    if cursor:
+        params["cursor"] = cursor
+    res = requests.get(f"{API_BASE}/predictions/", params=params)
+    if res.status_code != 200:
+        return None
+    return res.json()
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_stats():
+    res = requests.get(f"{API_BASE}/predictions/stats/")
+    if res.status_code != 200:
+        return None
+    return res.json()
+
+
+# Keyset cursors of the pages visited so far, so "Previous" can go back
+if "cursors" not in st.session_state:
+    st.session_state.cursors = [None]
+cursor = st.session_state.cursors[-1]
+
+# Titles and labels first; review text only for this page and only on request
+show_text = st.toggle("Show review text")
+fields = "id,title,sentiment,raw_text,cleaned_text" if show_text else "id,title,sentiment"
+page = fetch_page(cursor, PAGE_SIZE, fields)
+if page is not None:
+    for item in page["results"]:
         st.subheader(f"🎬 {item['title']}")
-        with st.expander("View Raw Review", expanded=False):
-            st.write("**Raw:**", item['raw_text'])
-        with st.expander("View Cleaned Text", expanded=False):
-            st.write("**Cleaned:**", item['cleaned_text'])
+        if show_text:
+            with st.expander("View Raw Review", expanded=False):
+                st.write("**Raw:**", item['raw_text'])
+            with st.expander("View Cleaned Text", expanded=False):
+                st.write("**Cleaned:**", item['cleaned_text'])
         st.write(f"**Sentiment:** `{item['sentiment']}`")
         st.write("---")
+
+    prev_col, page_col, next_col = st.columns(3)
+    if prev_col.button("⬅ Previous", disabled=len(st.session_state.cursors) == 1):
+        st.session_state.cursors.pop()
+        st.rerun()
+    page_col.write(f"Page {len(st.session_state.cursors)}")
+    if next_col.button("Next ➡", disabled=not page["next_cursor"]):
+        st.session_state.cursors.append(page["next_cursor"])
+        st.rerun()
 else:
     st.error("Could not fetch predictions.")
 
@@ -35,6 +81,11 @@ if st.button("Predict"):
         resp = requests.post(f"{API_BASE}/predict/", json={"text": new_text})
         if resp.status_code == 200:
             data = resp.json()
+            # The listing is oldest first, so the new prediction lands on the
+            # last page (a cached last page would also lack its next cursor);
+            # drop every cached page along with the counts
+            fetch_page.clear()
+            fetch_stats.clear()
             st.success(f"Cleaned: {data['cleaned_text']}")
             st.success(f"Sentiment: {data['sentiment']}")
         else:
@@ -46,69 +97,91 @@ if st.button("Ask"):
     if q.strip() == "":
         st.warning("Type your question first.")
     else:
-        res = requests.post(f"{API_BASE}/ask/", json={"question": q})
+        # Stream the answer and show it as it is generated
+        res = requests.post(f"{API_BASE}{ASK_PATH}", json={"question": q, "stream": True}, stream=True)
         if res.status_code == 200:
-            st.success(res.json()["answer"])
+            res.encoding = "utf-8"
+            placeholder = st.empty()
+            answer = ""
+            event = None
+            # chunk_size=None hands over data as soon as it arrives
+            for line in res.iter_lines(chunk_size=None, decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[5:])
+                    if event == "error":
+                        st.error("Model error. Please try again.")
+                        break
+                    if "text" in data:
+                        answer += data["text"]
+                        placeholder.success(answer)
+                    event = None
         else:
             st.error("Model error. Please try again.")
 
+@st.cache_data(show_spinner=False)
+def render_chart(counts):
+    """PNG of the pie chart; rebuilt only when ``counts`` change"""
+    labels = [label for label, _ in counts]
+    values = [count for _, count in counts]
+
+    # Create matplotlib pie chart
+    fig, ax = plt.subplots(figsize=(8, 6))
+    
+    # Set purple background
+    fig.patch.set_facecolor((9/255, 70/255, 126/255, 1.0))   
+    ax.set_facecolor('purple')
+    
+    colors = ['#ff9999', '#66b3ff', '#99ff99', '#ffcc99', '#ff99cc']  # Custom colors
+    wedges, texts, autotexts = ax.pie(
+        values, 
+        labels=labels, 
+        autopct='%1.1f%%',
+        colors=colors[:len(labels)],
+        startangle=90,
+        wedgeprops={'edgecolor': 'white', 'linewidth': 2}  # White boundary
+    )
+    
+    # Customize the chart
+    ax.set_title("Sentiment Breakdown", fontsize=16, fontweight='bold', color='white')
+    
+    # Make percentage text more readable
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontweight('bold')
+    
+    # Make label text white for better visibility on purple background
+    for text in texts:
+        text.set_color('white')
+        text.set_fontweight('bold')
+    
+    # Equal aspect ratio ensures that pie is drawn as a circle
+    ax.axis('equal')
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", facecolor=fig.get_facecolor())
+    # Close the figure to prevent memory issues
+    plt.close(fig)
+    return buffer.getvalue()
+
+
 st.header("📊 Sentiment Distribution")
 
-# Call your API
-res = requests.get(f"{API_BASE}/predictions/")
+# Counts are computed by the database; only a few bytes come back
+stats = fetch_stats()
 
-if res.status_code == 200:
-    predictions = res.json()
-    
-    # Count sentiments
+if stats is not None:
+    # Merge labels case-insensitively, as the chart always has
     counts = {}
-    for item in predictions:
-        label = item['sentiment'].lower()
-        counts[label] = counts.get(label, 0) + 1
-    
+    for label, count in stats["counts"].items():
+        label = label.lower()
+        counts[label] = counts.get(label, 0) + count
+
     if counts:
-        labels = list(counts.keys())
-        values = list(counts.values())
-
-        # Create matplotlib pie chart
-        fig, ax = plt.subplots(figsize=(8, 6))
-        
-        # Set purple background
-        fig.patch.set_facecolor((9/255, 70/255, 126/255, 1.0))   
-        ax.set_facecolor('purple')
-        
-        colors = ['#ff9999', '#66b3ff', '#99ff99', '#ffcc99', '#ff99cc']  # Custom colors
-        wedges, texts, autotexts = ax.pie(
-            values, 
-            labels=labels, 
-            autopct='%1.1f%%',
-            colors=colors[:len(labels)],
-            startangle=90,
-            wedgeprops={'edgecolor': 'white', 'linewidth': 2}  # White boundary
-        )
-        
-        # Customize the chart
-        ax.set_title("Sentiment Breakdown", fontsize=16, fontweight='bold', color='white')
-        
-        # Make percentage text more readable
-        for autotext in autotexts:
-            autotext.set_color('white')
-            autotext.set_fontweight('bold')
-        
-        # Make label text white for better visibility on purple background
-        for text in texts:
-            text.set_color('white')
-            text.set_fontweight('bold')
-        
-        # Equal aspect ratio ensures that pie is drawn as a circle
-        ax.axis('equal')
-        
         # Display the chart in Streamlit
-        st.pyplot(fig)
-        
-        # Clear the figure to prevent memory issues
-        plt.clf()
+        st.image(render_chart(tuple(sorted(counts.items()))))
     else:
         st.info("No predictions to display yet. Please run some predictions first!")
 else:
-    st.error("Could not fetch predictions for chart.")
\ No newline at end of file
+    st.error("Could not fetch predictions for chart.")